@@ -1,22 +1,48 @@
 import streamlit as st
 import os
-import subprocess
-from datetime import datetime
+import uuid
 import re
+from compile_engine import CompileEngine, CompileQueueFull, find_tex_file, pdf_download_name
+from compile_ui import (compile_progress, compile_running, remember_diagnostics, remember_timings,
+                        show_diagnostics, show_log_tail, show_project_files, show_timings, start_compile,
+                        take_finished_job, show_compile_failure)
+from pdf_documents import PdfDocumentManager
+from pdf_publish import PdfPublisher
 
 # Streamlit page configuration
 st.set_page_config(page_title="Elsevier LaTeX Compiler", layout="wide")
 
 # Title and description
 st.title("Elsevier LaTeX Compiler")
-st.write("Compiles a `.tex` file from the `manuscript` directory using latexmk. The `.tex` content and table of contents are shown on the left, and the PDF preview (empty initially) on the right.")
+st.write("Compiles a `.tex` file from the `manuscript` directory with pdflatex, running bibtex and the extra passes only when the document needs them. The `.tex` content and table of contents are shown on the left, and the PDF preview (empty initially) on the right.")
 
 # Get the directory of the current .py file
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
+# One compile engine (and worker pool) shared by every session of this app
+@st.cache_resource
+def get_compile_engine(manuscript_dir):
+    return CompileEngine(manuscript_dir)
+
+# Compiled PDFs live on disk instead of in session state
+@st.cache_resource
+def get_pdf_documents():
+    return PdfDocumentManager()
+
+# Compiled PDFs are served as static files instead of inline data URIs
+@st.cache_resource
+def get_pdf_publisher():
+    return PdfPublisher()
+
+# Each browser session builds in its own directory
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# The last good PDF survives reruns while the next build runs in the background
+if 'pdf_filename' not in st.session_state:
+    st.session_state.pdf_filename = None
+
 # Initialize variables
-pdf_data = None
-pdf_filename = None
 tex_content = ""
 toc_items = []
 
@@ -40,22 +66,12 @@ with col1:
     if not os.path.exists(manuscript_dir):
         st.error("`manuscript` directory not found in the same directory as this script.")
     else:
-        # Log files in manuscript directory for debugging
-        manuscript_files = []
-        for root, _, files in os.walk(manuscript_dir):
-            for file in files:
-                manuscript_files.append(os.path.join(root, file))
-        if manuscript_files:
-            st.write("Files in manuscript directory:", manuscript_files)
-        else:
+        # List the manuscript directory for debugging (cached; re-read only where it changed)
+        if not show_project_files(manuscript_dir):
             st.error("No files found in the `manuscript` directory.")
 
-        # Search for a .tex file in the manuscript directory
-        tex_file_path = None
-        for file in os.listdir(manuscript_dir):
-            if file.endswith(".tex"):
-                tex_file_path = os.path.join(manuscript_dir, file)
-                break
+        # Search for the main .tex file in the manuscript directory
+        tex_file_path = find_tex_file(manuscript_dir)
         if not tex_file_path:
             st.error("No `.tex` file found in the `manuscript` directory.")
         else:
@@ -73,53 +89,62 @@ with col1:
             else:
                 st.warning("No sections found in the `.tex` file for the table of contents.")
 
-            # Display .tex content
-            st.write(f"Content of {os.path.basename(tex_file_path)}:")
-            st.text_area("", value=tex_content, height=400, disabled=True)
+            # Display .tex content on request; the whole document is otherwise resent on every rerun
+            if st.checkbox(f"Show content of {os.path.basename(tex_file_path)}", value=False):
+                st.text_area("", value=tex_content, height=400, disabled=True)
 
             # Compile button
             if st.button("Compile LaTeX"):
                 try:
-                    # Compile with latexmk
-                    result = subprocess.run(
-                        ["latexmk", "-pdf", "-pdflatex=pdflatex", "-interaction=nonstopmode", tex_file_path],
-                        cwd=manuscript_dir,
-                        capture_output=True,
-                        text=True,
-                        timeout=120
-                    )
-                    pdf_file_path = os.path.splitext(tex_file_path)[0] + ".pdf"
-                    if result.returncode == 0 and os.path.exists(pdf_file_path):
-                        # Read the PDF file
-                        with open(pdf_file_path, "rb") as f:
-                            pdf_data = f.read()
-                        pdf_filename = f"compiled_{os.path.basename(os.path.splitext(tex_file_path)[0])}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+                    # Queue the build for this session's own build directory
+                    engine = get_compile_engine(manuscript_dir)
+                    start_compile(engine, os.path.basename(tex_file_path), tex_content)
+                except CompileQueueFull as busy:
+                    st.error(str(busy))
+
+            # Live log and Cancel button while the build runs in the background
+            if compile_running():
+                compile_progress()
+
+            finished_job = take_finished_job()
+            if finished_job is not None:
+                try:
+                    result = finished_job.result()
+                    remember_diagnostics(finished_job.tex_name, result)
+                    if result.success:
+                        # Keep an immutable copy of the build output
+                        adopted = get_pdf_documents().adopt(st.session_state.session_id, result.pdf_path)
+                        remember_timings(result, adopted)
+                        st.session_state.pdf_filename = pdf_download_name(finished_job.tex_name, draft=result.draft)
 
                         # Display success message
-                        st.success("LaTeX compiled successfully with latexmk!")
+                        st.success("Sources unchanged, PDF loaded from the compile cache." if result.cached else "LaTeX compiled successfully!")
                     else:
-                        st.error("PDF generation failed. Check the latexmk log below:")
-                        st.text_area("latexmk Log", value=result.stdout + result.stderr, height=200, disabled=True)
+                        st.error("PDF generation failed. Check the compilation log below:")
+                        show_log_tail(result)
+
+                except Exception as error:
+                    show_compile_failure(error, hint="Please ensure all required files (e.g., cas-sc.cls, .bib, figures) are included.")
 
-                except subprocess.TimeoutExpired:
-                    st.error("LaTeX compilation timed out. Please simplify your document or check for errors.")
-                except Exception as latexmk_error:
-                    st.error(f"latexmk compilation failed: {str(latexmk_error)}")
-                    st.write("Please ensure all required files (e.g., cas-sc.cls, .bib, figures) are included.")
+            show_diagnostics()
 
 with col2:
     # PDF preview (empty initially)
     st.write("### PDF Preview")
-    if pdf_data is not None:
+    pdf = get_pdf_documents().get(st.session_state.session_id)
+    pdf_filename = st.session_state.pdf_filename
+    if pdf is not None:
+        show_timings()
         st.download_button(
             label="Download PDF",
-            data=pdf_data,
+            data=pdf.read_bytes(),
             file_name=pdf_filename,
             mime="application/pdf"
         )
+        pdf_url = get_pdf_publisher().publish(pdf.pdf_hash, pdf.path)
         st.components.v1.html(
             f"""
-            <object data="data:application/pdf;base64,{pdf_data.hex()}" type="application/pdf" width="100%" height="600px">
+            <object data="{pdf_url}" type="application/pdf" width="100%" height="600px">
                 <p>Your browser does not support PDF preview. Please download the PDF.</p>
             </object>
             """,
@@ -151,7 +176,6 @@ st.markdown("""
    - `packages.txt`:
      ```
      texlive-full
-     latexmk
      ```
 4. Example `paper.tex`:
    ```latex
@@ -186,7 +210,7 @@ st.markdown("""
    ```bash
    conda activate stenv
    pip install streamlit
-   sudo apt-get install texlive-full latexmk
+   sudo apt-get install texlive-full
    streamlit run texcompiler.py
    ```
 7. For Streamlit Cloud, push to `anilkunwar/latex_typesetting`.
@@ -1,10 +1,13 @@
 import streamlit as st
 import os
-import subprocess
-from datetime import datetime
+import uuid
 import re
-import base64
-from streamlit_ace import st_ace
+from compile_engine import CompileEngine, CompileQueueFull, find_tex_file, pdf_download_name
+from compile_ui import (compile_progress, compile_running, remember_diagnostics, remember_timings,
+                        show_diagnostics, show_log_tail, show_timings, start_compile, take_finished_job,
+                        show_compile_failure)
+from pdf_documents import PdfDocumentManager
+from pdf_publish import PdfPublisher
 
 # Streamlit page config
 st.set_page_config(page_title="Elsevier LaTeX Compiler", layout="wide")
@@ -15,17 +18,35 @@ st.title("📄 Elsevier LaTeX Compiler")
 script_dir = os.path.dirname(os.path.abspath(__file__))
 manuscript_dir = os.path.join(script_dir, "manuscript")
 
+# One compile engine (and worker pool) shared by every session of this app
+@st.cache_resource
+def get_compile_engine(manuscript_dir):
+    return CompileEngine(manuscript_dir)
+
+# Compiled PDFs live on disk instead of in session state
+@st.cache_resource
+def get_pdf_documents():
+    return PdfDocumentManager()
+
+# Compiled PDFs are served as static files instead of inline data URIs
+@st.cache_resource
+def get_pdf_publisher():
+    return PdfPublisher()
+
+# Each browser session builds in its own directory
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# The last good PDF survives reruns while the next build runs in the background
+if 'pdf_filename' not in st.session_state:
+    st.session_state.pdf_filename = None
+
 # Check manuscript folder
 if not os.path.exists(manuscript_dir):
     st.error("❌ `manuscript/` directory not found.")
     st.stop()
 
-# Find a .tex file
-tex_file_path = None
-for file in os.listdir(manuscript_dir):
-    if file.endswith(".tex"):
-        tex_file_path = os.path.join(manuscript_dir, file)
-        break
+# Find the main .tex file
+tex_file_path = find_tex_file(manuscript_dir)
 
 if not tex_file_path:
     st.error("❌ No `.tex` file found in `manuscript/`.")
@@ -60,7 +81,8 @@ with col1:
         else:
             st.info("No sections found.")
 
-    # Ace Editor (syntax-highlighted)
+    # Ace Editor (syntax-highlighted); imported here so the title and TOC are drawn before it loads
+    from streamlit_ace import st_ace
     edited_tex = st_ace(
         value=tex_content,
         language="latex",
@@ -70,6 +92,7 @@ with col1:
     )
 
     auto_compile = st.checkbox("🔁 Auto-compile after saving", value=False)
+    draft_preview = st.checkbox("⚡ Draft preview (single pass, no bibtex, low-res figures)", value=False)
 
     compile_triggered = False
 
@@ -83,44 +106,51 @@ with col1:
     if st.button("🛠 Compile LaTeX"):
         compile_triggered = True
 
-    pdf_data = None
-    pdf_filename = None
-
     if compile_triggered:
         try:
-            result = subprocess.run(
-                ["latexmk", "-pdf", "-interaction=nonstopmode", tex_file_path],
-                cwd=manuscript_dir,
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
-            pdf_path = os.path.splitext(tex_file_path)[0] + ".pdf"
-
-            if result.returncode == 0 and os.path.exists(pdf_path):
-                with open(pdf_path, "rb") as f:
-                    pdf_data = f.read()
-                pdf_filename = f"compiled_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-                st.success("✅ PDF compiled successfully.")
+            engine = get_compile_engine(manuscript_dir)
+            start_compile(engine, os.path.basename(tex_file_path), edited_tex, draft=draft_preview)
+        except CompileQueueFull as busy:
+            st.error(f"⏳ {busy}")
+
+    # Live log and Cancel button while the build runs in the background
+    if compile_running():
+        compile_progress()
+
+    finished_job = take_finished_job()
+    if finished_job is not None:
+        try:
+            result = finished_job.result()
+            remember_diagnostics(finished_job.tex_name, result)
+
+            if result.success:
+                adopted = get_pdf_documents().adopt(st.session_state.session_id, result.pdf_path)
+                remember_timings(result, adopted)
+                st.session_state.pdf_filename = pdf_download_name(finished_job.tex_name, draft=result.draft)
+                st.success("✅ Sources unchanged, PDF loaded from cache." if result.cached else "✅ PDF compiled successfully.")
             else:
                 st.error("❌ Compilation failed.")
-                st.text_area("latexmk Output", result.stdout + result.stderr, height=200)
-        except subprocess.TimeoutExpired:
-            st.error("⏳ Compilation timed out.")
-        except Exception as e:
-            st.error(f"⚠️ Error: {e}")
+                show_log_tail(result)
+        except Exception as error:
+            show_compile_failure(error)
+
+    show_diagnostics()
 
 with col2:
     st.subheader("📄 PDF Preview")
 
-    if pdf_data:
-        b64_pdf = base64.b64encode(pdf_data).decode("utf-8")
-        pdf_view = f'<iframe src="data:application/pdf;base64,{b64_pdf}" width="100%" height="600"></iframe>'
+    pdf = get_pdf_documents().get(st.session_state.session_id)
+    pdf_filename = st.session_state.pdf_filename
+
+    if pdf is not None:
+        show_timings()
+        pdf_url = get_pdf_publisher().publish(pdf.pdf_hash, pdf.path)
+        pdf_view = f'<iframe src="{pdf_url}" width="100%" height="600"></iframe>'
         st.markdown(pdf_view, unsafe_allow_html=True)
 
         st.download_button(
             label="📥 Download PDF",
-            data=pdf_data,
+            data=pdf.read_bytes(),
             file_name=pdf_filename,
             mime="application/pdf"
         )
@@ -0,0 +1,124 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from compile_engine import CompileEngine, find_tex_file
+from metrics import METRICS
+
+# Compile many manuscript directories without the Streamlit UI, one process per manuscript:
+#   python batch_compile.py submissions/ --jobs 8 --output-dir pdfs/
+
+
+def manuscript_dirs(paths):
+    # A path holding a .tex file is a manuscript; otherwise its subdirectories are scanned
+    found = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            continue
+        if any(name.endswith(".tex") for name in os.listdir(path)):
+            found.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            if os.path.isdir(child) and any(n.endswith(".tex") for n in os.listdir(child)):
+                found.append(child)
+    return found
+
+
+def compile_manuscript(manuscript_dir, output_dir=None, draft=False, timeout=120):
+    # Runs in a worker process; returns a plain dict so it pickles back to the parent
+    # Timings are printed in the summary; keep workers from overwriting the app's metrics file
+    METRICS.path = None
+    started = time.monotonic()
+    summary = {"manuscript": manuscript_dir, "tex": None, "status": "failed", "cached": False,
+               "seconds": 0.0, "pdf": None}
+    tex_path = find_tex_file(manuscript_dir)
+    if tex_path is None:
+        summary["status"] = "no .tex file"
+        return summary
+    tex_name = os.path.basename(tex_path)
+    summary["tex"] = tex_name
+    with open(tex_path, "r", encoding="utf-8") as f:
+        tex_source = f.read()
+
+    # A stable session per manuscript lets the next batch reuse its .aux/.bbl files
+    session_id = "batch-" + hashlib.sha256(manuscript_dir.encode("utf-8")).hexdigest()[:16]
+    engine = CompileEngine(manuscript_dir, max_workers=1, timeout=timeout)
+    try:
+        result = engine.compile(session_id, tex_name, tex_source, draft=draft)
+    except subprocess.TimeoutExpired:
+        summary["status"] = "timeout"
+        result = None
+    except Exception as error:
+        summary["status"] = f"error: {error}"
+        result = None
+    finally:
+        engine.shutdown()
+    summary["seconds"] = time.monotonic() - started
+
+    if result is not None:
+        summary["status"] = "ok" if result.success else f"failed (exit {result.returncode})"
+        summary["cached"] = result.cached
+        if output_dir:
+            name = os.path.basename(manuscript_dir.rstrip(os.sep))
+            if result.success:
+                summary["pdf"] = os.path.join(output_dir, f"{name}.pdf")
+                shutil.copyfile(result.pdf_path, summary["pdf"])
+            else:
+                with open(os.path.join(output_dir, f"{name}.log"), "w", encoding="utf-8") as f:
+                    f.write(result.log)
+    return summary
+
+
+def print_summary(results, wall_seconds):
+    width = max([len(os.path.basename(r["manuscript"])) for r in results] + [10])
+    print(f"{'manuscript':<{width}}  {'status':<20}  {'time':>8}  pdf")
+    for r in results:
+        status = r["status"] + (" (cached)" if r["cached"] else "")
+        print(f"{os.path.basename(r['manuscript']):<{width}}  {status:<20}  {r['seconds']:>7.1f}s  {r['pdf'] or '-'}")
+    ok = sum(1 for r in results if r["status"] == "ok")
+    busy = sum(r["seconds"] for r in results)
+    print(f"\n{ok}/{len(results)} compiled in {wall_seconds:.1f}s wall time "
+          f"({busy:.1f}s of compile time, {busy / wall_seconds if wall_seconds else 0:.1f}x parallel)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile LaTeX manuscript directories in parallel.")
+    parser.add_argument("paths", nargs="+",
+                        help="manuscript directories, or folders whose subdirectories are manuscripts")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="manuscripts compiled at once (default: all cores)")
+    parser.add_argument("-o", "--output-dir", help="copy each PDF (or failure log) here as <manuscript>.pdf")
+    parser.add_argument("--draft", action="store_true", help="single pdflatex pass, no bibtex, downsampled figures")
+    parser.add_argument("--timeout", type=int, default=120, help="seconds allowed per manuscript")
+    args = parser.parse_args(argv)
+
+    dirs = manuscript_dirs(args.paths)
+    if not dirs:
+        print("No manuscript directories with a .tex file found.", file=sys.stderr)
+        return 2
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(dirs))) as pool:
+        futures = [pool.submit(compile_manuscript, d, args.output_dir, args.draft, args.timeout) for d in dirs]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(f"[{len(results)}/{len(dirs)}] {os.path.basename(r['manuscript'])}: {r['status']} "
+                  f"in {r['seconds']:.1f}s", flush=True)
+    results.sort(key=lambda r: r["manuscript"])
+    print()
+    print_summary(results, time.monotonic() - started)
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
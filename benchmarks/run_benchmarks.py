@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+# Times the compile, render and outline hot paths and writes the results as JSON:
+#   python benchmarks/run_benchmarks.py -o benchmarks/results/$(git rev-parse --short HEAD).json
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/results/<older>.json
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fitz  # PyMuPDF for PDF rendering
+from compile_cache import CompileCache
+from compile_engine import CompileEngine, find_tex_file
+from metrics import METRICS
+from outline_index import OutlineIndex
+from page_renderer import PageRenderer
+from preamble_format import PreambleFormats
+
+MANUSCRIPT_DIR = os.path.join(REPO_DIR, "manuscript")
+SYNTHETIC_SIZES_MB = (1, 2, 5, 10)
+ZOOM_LEVELS = (1, 2, 3)
+
+
+def measure(function, repeat, setup=None):
+    # Returns per-run seconds; setup() runs untimed before each call and its result is passed in
+    runs = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument) if setup else function()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+
+def record(results, name, runs, **params):
+    results.append({
+        "name": name,
+        "params": params,
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs)
+    })
+    label = " ".join(f"{k}={v}" for k, v in params.items())
+    print(f"{name:<28} {label:<24} median {statistics.median(runs) * 1000:10.3f} ms  "
+          f"min {min(runs) * 1000:10.3f} ms  ({len(runs)} runs)", flush=True)
+
+
+def legacy_toc(content):
+    # The line-by-line regex the apps used before OutlineIndex, kept as a reference point
+    toc = []
+    pattern = re.compile(r'\\(part|chapter|section|subsection|subsubsection|paragraph|subparagraph)\*?\s*{([^}]*)}')
+    for i, line in enumerate(content.splitlines()):
+        match = pattern.search(line)
+        if match:
+            toc.append({"title": match.group(2), "line": i, "level": match.group(1)})
+    return toc
+
+
+def synthetic_document(size_bytes, seed=0):
+    # Sections, subsections and filler paragraphs until the document reaches size_bytes
+    rng = random.Random(seed)
+    words = ("strain", "domain", "polarization", "lattice", "phase", "field", "grain", "boundary",
+             "dielectric", "coefficient", "temperature", "$\\epsilon_{r}$", "\\cite{ref}")
+    parts = ["\\documentclass{article}\n\\begin{document}\n"]
+    size = len(parts[0])
+    section = 0
+    while size < size_bytes:
+        section += 1
+        block = [f"\\section{{Section {section} on \\emph{{{rng.choice(words)}}}}}\n"]
+        for sub in range(rng.randint(1, 4)):
+            block.append(f"\\subsection{{Part {section}.{sub}}}\n")
+            for _ in range(rng.randint(2, 6)):
+                block.append(" ".join(rng.choice(words) for _ in range(rng.randint(40, 120))) + "\n\n")
+        text = "".join(block)
+        parts.append(text)
+        size += len(text)
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def bench_outline(results, documents, repeat):
+    for label, text in documents:
+        record(results, "outline.legacy_regex", measure(lambda: legacy_toc(text), repeat), document=label)
+        record(results, "outline.full_scan", measure(lambda: OutlineIndex().update(text), repeat),
+               document=label)
+
+        # Single-character edits at random places, as typed into the editor; the edited text
+        # already exists in the editor buffer, so only the outline update is timed
+        index = OutlineIndex()
+        index.update(text)
+        rng = random.Random(1)
+
+        def typed():
+            position = rng.randrange(len(index.text))
+            return position, index.text[:position] + "x" + index.text[position:]
+
+        def edit(typed_edit):
+            position, edited = typed_edit
+            index.apply_edit(position, position, "x", edited)
+
+        record(results, "outline.incremental_edit", measure(edit, repeat * 20, setup=typed), document=label)
+
+
+def bench_compile(results, manuscript_dir, repeat, work_dir):
+    tex_path = find_tex_file(manuscript_dir)
+    tex_name = os.path.basename(tex_path)
+    with open(tex_path, "r", encoding="utf-8") as f:
+        tex_source = f.read()
+
+    def fresh_engine(_=None):
+        # Empty build, cache and format folders: nothing from earlier runs can be reused
+        root = tempfile.mkdtemp(dir=work_dir)
+        engine = CompileEngine(manuscript_dir, max_workers=1, build_root=os.path.join(root, "builds"),
+                               cache=CompileCache(os.path.join(root, "cache")))
+        engine.formats = PreambleFormats(engine.manuscript_dir, engine.cache.hasher, engine.graph,
+                                         format_root=os.path.join(root, "formats"))
+        return engine
+
+    pdf_paths = []
+
+    def cold(engine):
+        result = engine.compile(uuid.uuid4().hex, tex_name, tex_source)
+        if not result.success:
+            raise RuntimeError("Benchmark build failed:\n" + result.log[-2000:])
+        pdf_paths.append(result.pdf_path)
+
+    record(results, "compile.cold", measure(cold, repeat, setup=fresh_engine), tex=tex_name)
+
+    engine = fresh_engine()
+    session_id = uuid.uuid4().hex
+    engine.compile(session_id, tex_name, tex_source)
+    record(results, "compile.warm_cached",
+           measure(lambda: engine.compile(session_id, tex_name, tex_source), repeat), tex=tex_name)
+
+    # A one-line change misses the cache but reuses the preamble format and .aux/.bbl files
+    edits = iter(range(1, 1 << 30))
+    record(results, "compile.warm_edited",
+           measure(lambda: engine.compile(session_id, tex_name, tex_source + f"\n% edit {next(edits)}\n"), repeat),
+           tex=tex_name)
+    record(results, "compile.warm_edited_draft",
+           measure(lambda: engine.compile(session_id, tex_name, tex_source + f"\n% edit {next(edits)}\n",
+                                          draft=True), repeat),
+           tex=tex_name)
+    engine.shutdown()
+    return pdf_paths[-1] if pdf_paths else None
+
+
+def bench_render(results, pdf_path, repeat, pages=3):
+    with fitz.open(pdf_path) as doc:
+        page_indexes = list(range(min(pages, doc.page_count)))
+        for zoom in ZOOM_LEVELS:
+            def rasterize():
+                for index in page_indexes:
+                    doc.load_page(index).get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+            runs = [run / len(page_indexes) for run in measure(rasterize, repeat)]
+            record(results, "render.fitz_page", runs, zoom=zoom)
+
+    renderer = PageRenderer()
+    renderer.render("bench", pdf_path, 0, prefetch=False)
+    record(results, "render.page_cache_hit",
+           measure(lambda: renderer.render("bench", pdf_path, 0, prefetch=False), repeat * 20), zoom=2)
+
+
+def compare(results, baseline_path, threshold):
+    # Prints benchmarks whose median got slower than the baseline by more than threshold
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(b["name"], json.dumps(b["params"], sort_keys=True)): b for b in json.load(f)["results"]}
+    regressions = 0
+    for r in results:
+        old = baseline.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old is None or old["median"] == 0:
+            continue
+        change = r["median"] / old["median"] - 1
+        if change > threshold:
+            regressions += 1
+            print(f"REGRESSION {r['name']} {r['params']}: {old['median'] * 1000:.2f} ms -> "
+                  f"{r['median'] * 1000:.2f} ms (+{change:.0%})")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark compile, render and outline hot paths.")
+    parser.add_argument("-o", "--output", default=os.path.join(REPO_DIR, "benchmarks", "results", "latest.json"))
+    parser.add_argument("--manuscript", default=MANUSCRIPT_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", choices=("compile", "render", "outline"), action="append",
+                        help="run only these groups (repeatable)")
+    parser.add_argument("--pdf", help="PDF to rasterize (default: the one the compile benchmark builds)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown reported as a regression")
+    args = parser.parse_args(argv)
+    groups = set(args.only or ("compile", "render", "outline"))
+    # Benchmark runs must not show up in the apps' metrics file
+    METRICS.path = None
+
+    results = []
+    skipped = []
+    pdf_path = args.pdf
+    work_dir = tempfile.mkdtemp(prefix="latex_bench_")
+    try:
+        if "compile" in groups:
+            if shutil.which("pdflatex"):
+                pdf_path = bench_compile(results, args.manuscript, args.repeat, work_dir) or pdf_path
+            else:
+                skipped.append("compile (pdflatex not found)")
+        if "render" in groups:
+            if pdf_path is None:
+                # Fall back to any PDF shipped with the manuscript
+                for root, _, files in os.walk(args.manuscript):
+                    pdf_path = next((os.path.join(root, f) for f in sorted(files) if f.endswith(".pdf")), None)
+                    if pdf_path:
+                        break
+            if pdf_path:
+                bench_render(results, pdf_path, args.repeat)
+            else:
+                skipped.append("render (no PDF available)")
+        if "outline" in groups:
+            with open(find_tex_file(args.manuscript), "r", encoding="utf-8") as f:
+                documents = [("manuscript", f.read())]
+            documents += [(f"synthetic_{mb}MB", synthetic_document(mb * 1024 * 1024)) for mb in SYNTHETIC_SIZES_MB]
+            bench_outline(results, documents, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pymupdf": fitz.VersionBind,
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "skipped": skipped,
+        "results": results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+    for reason in skipped:
+        print(f"Skipped {reason}")
+
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from pdf_publish import STATIC_DIR
+
+# Citation lists for the editor's autocomplete, served at ./app/static/bib/
+INDEX_SUBDIR = "bib"
+
+ENTRY_START_PATTERN = re.compile(r'@\s*([A-Za-z]+)\s*([{(])')
+DELIMITER_PATTERN = re.compile(r'[{}()"]')
+FIELD_NAME_PATTERN = re.compile(r'\s*,?\s*([A-Za-z][\w\-:.+]*)\s*=\s*')
+# What bibtex reads from the .aux: cited keys (\citation{*} for \nocite{*}) and included .aux files
+CITATION_PATTERN = re.compile(r'\\citation\{([^}]*)\}')
+AUX_INPUT_PATTERN = re.compile(r'\\@input\{([^}]*)\}')
+BIBDATA_PATTERN = re.compile(r'\\bibdata\{([^}]*)\}')
+BIBSTYLE_PATTERN = re.compile(r'\\bibstyle\{([^}]*)\}')
+LATEX_MARKUP_PATTERN = re.compile(r'[{}]|\\[a-zA-Z]+\s*|\\.')
+
+# Fields kept from each entry for autocomplete hints and crossref resolution
+INDEXED_FIELDS = ("author", "editor", "title", "year", "crossref")
+
+
+class BibEntry:
+    def __init__(self, entry_type, key, text, fields):
+        self.entry_type = entry_type
+        self.key = key
+        # The entry exactly as written, so the trimmed .bib is byte-for-byte what bibtex would read
+        self.text = text
+        self.fields = fields
+
+    def hint(self):
+        # "Author (Year) Title", plain text for the autocomplete popup
+        names = self.fields.get("author") or self.fields.get("editor") or ""
+        first = _plain(names.split(" and ")[0]).split(",")[0].strip()
+        if " and " in names:
+            first += " et al."
+        year = _plain(self.fields.get("year", ""))
+        title = _plain(self.fields.get("title", ""))
+        return " ".join(part for part in (first, f"({year})" if year else "", title) if part)
+
+
+class BibFile:
+    def __init__(self, entries, extras):
+        # Regular entries in file order, plus @string/@preamble blocks every trimmed copy keeps
+        self.entries = entries
+        self.extras = extras
+        # bibtex matches cite keys case-insensitively
+        self.by_key = {}
+        for entry in entries:
+            self.by_key.setdefault(entry.key.lower(), entry)
+
+
+def _plain(value):
+    return " ".join(LATEX_MARKUP_PATTERN.sub("", value).split())
+
+
+def _block_end(text, start, opener):
+    # Index just past the block opened at text[start - 1]; braces nest, quotes only matter in
+    # "(...)" blocks where they may hide a ")"
+    closer = "}" if opener == "{" else ")"
+    depth = 0
+    in_quotes = False
+    for match in DELIMITER_PATTERN.finditer(text, start):
+        char = match.group(0)
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            if depth == 0 and closer == "}":
+                return match.end()
+            depth -= 1
+        elif char == '"' and depth == 0 and opener == "(":
+            in_quotes = not in_quotes
+        elif char == ")" and depth == 0 and not in_quotes and closer == ")":
+            return match.end()
+    return len(text)
+
+
+def _field_values(body):
+    # name -> raw value (outer braces or quotes removed) for the fields autocomplete needs
+    fields = {}
+    pos = 0
+    while True:
+        match = FIELD_NAME_PATTERN.match(body, pos)
+        if not match:
+            break
+        name = match.group(1).lower()
+        pos = match.end()
+        if pos < len(body) and body[pos] in '{"':
+            # {...} or "..." value; both may hold nested braces
+            quote = body[pos]
+            depth = 0
+            end = pos + 1
+            while end < len(body):
+                char = body[end]
+                if char == "{":
+                    depth += 1
+                elif char == "}":
+                    if depth == 0 and quote == "{":
+                        break
+                    depth -= 1
+                elif char == '"' and depth == 0 and quote == '"':
+                    break
+                end += 1
+            value = body[pos + 1:end]
+            pos = end + 1
+        else:
+            end = body.find(",", pos)
+            end = len(body) if end < 0 else end
+            value = body[pos:end].strip()
+            pos = end
+        if name in INDEXED_FIELDS:
+            fields[name] = value
+    return fields
+
+
+def parse_bib(text):
+    # Splits a .bib file into entries the way bibtex does: text outside @...{} blocks is ignored
+    entries = []
+    extras = []
+    pos = 0
+    while True:
+        match = ENTRY_START_PATTERN.search(text, pos)
+        if not match:
+            break
+        entry_type = match.group(1).lower()
+        end = _block_end(text, match.end(), match.group(2))
+        block = text[match.start():end]
+        pos = end
+        if entry_type == "comment":
+            continue
+        if entry_type in ("string", "preamble"):
+            extras.append(block)
+            continue
+        body = text[match.end():end - 1]
+        key, _, rest = body.partition(",")
+        key = key.strip()
+        if key:
+            entries.append(BibEntry(entry_type, key, block, _field_values(rest)))
+    return BibFile(entries, extras)
+
+
+class AuxBibliography:
+    # What bibtex will read from a build's .aux files: every cited key, the \bibliography
+    # databases and the style, from the main document and each \input/\include file alike
+    def __init__(self, citations, bib_names, bib_style):
+        self.citations = citations
+        self.bib_names = bib_names
+        self.bib_style = bib_style
+
+
+def aux_bibliography(build_dir, stem):
+    # Read from <stem>.aux and the .aux files it includes (\include); None when there is no .aux yet
+    citations = set()
+    bib_names = []
+    bib_style = None
+    pending = [stem + ".aux"]
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        path = os.path.join(build_dir, name)
+        if not os.path.isfile(path):
+            if name == stem + ".aux":
+                return None
+            continue
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            content = f.read()
+        for match in CITATION_PATTERN.finditer(content):
+            citations.update(key.strip() for key in match.group(1).split(",") if key.strip())
+        for match in BIBDATA_PATTERN.finditer(content):
+            bib_names.extend(name.strip() for name in match.group(1).split(",") if name.strip())
+        style = BIBSTYLE_PATTERN.search(content)
+        if style and bib_style is None:
+            bib_style = style.group(1).strip()
+        pending.extend(match.group(1) for match in AUX_INPUT_PATTERN.finditer(content))
+    return AuxBibliography(frozenset(citations), tuple(bib_names), bib_style)
+
+
+def bib_files(manuscript_dir):
+    return sorted(glob.glob(os.path.join(manuscript_dir, "*.bib")))
+
+
+class BibStore:
+    # Parsed .bib files, re-read only when a file's size or mtime changes
+    def __init__(self, static_dir=STATIC_DIR, max_index_files=16):
+        self.index_dir = os.path.join(static_dir, INDEX_SUBDIR)
+        self.max_index_files = max_index_files
+        # path -> ((size, mtime), BibFile)
+        self._files = {}
+        # tuple of (path, size, mtime) -> published index URL
+        self._index_urls = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def load(self, path):
+        stamp = self._stamp(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            bib = parse_bib(f.read())
+        with self._lock:
+            self._files[path] = (stamp, bib)
+        return bib
+
+    def trimmed_text(self, path, cite_keys):
+        # The .bib reduced to the cited entries (and the entries they crossref), in file order
+        bib = self.load(path)
+        wanted = {key.lower() for key in cite_keys}
+        # A crossref'd parent has to be in the same file for bibtex to inherit from it
+        pending = list(wanted)
+        while pending:
+            entry = bib.by_key.get(pending.pop())
+            parent = entry.fields.get("crossref", "").strip().lower() if entry else ""
+            if parent and parent not in wanted:
+                wanted.add(parent)
+                pending.append(parent)
+        kept = [entry.text for entry in bib.entries if entry.key.lower() in wanted]
+        header = f"% {len(kept)} of {len(bib.entries)} entries from {os.path.basename(path)}, trimmed to the citations\n\n"
+        return header + "\n\n".join(bib.extras + kept) + "\n", len(kept), len(bib.entries)
+
+    def prepare(self, path, target, cite_keys):
+        # Puts the .bib bibtex should read at target: a trimmed copy, or a link to the whole file
+        # when the citations are unknown or include \nocite{*}. Returns (entries kept, entries total).
+        if cite_keys is None or "*" in cite_keys:
+            if not (os.path.islink(target) and os.readlink(target) == path):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(path, target)
+            total = len(self.load(path).entries)
+            return total, total
+        text, kept, total = self.trimmed_text(path, cite_keys)
+        if not os.path.islink(target) and os.path.isfile(target):
+            with open(target, "r", encoding="utf-8", errors="replace") as f:
+                if f.read() == text:
+                    # Unchanged: keep the mtime so nothing downstream sees a new file
+                    return kept, total
+        if os.path.lexists(target):
+            os.remove(target)
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(text)
+        return kept, total
+
+    def index_url(self, paths):
+        # URL of a JSON list of [key, hint] for every entry, published once per version of the files
+        state = tuple((path,) + self._stamp(path) for path in paths)
+        with self._lock:
+            url = self._index_urls.get(state)
+        if url and os.path.exists(os.path.join(self.index_dir, os.path.basename(url))):
+            return url
+        index = []
+        seen = set()
+        for path in paths:
+            for entry in self.load(path).entries:
+                # bibtex uses the first of repeated keys
+                if entry.key.lower() not in seen:
+                    seen.add(entry.key.lower())
+                    index.append([entry.key, entry.hint()])
+        data = json.dumps(index, ensure_ascii=False).encode("utf-8")
+        name = hashlib.sha256(data).hexdigest()[:16] + ".json"
+        os.makedirs(self.index_dir, exist_ok=True)
+        target = os.path.join(self.index_dir, name)
+        if not os.path.exists(target):
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+            self._evict()
+        url = f"./app/static/{INDEX_SUBDIR}/{name}"
+        with self._lock:
+            self._index_urls[state] = url
+        return url
+
+    def _evict(self):
+        files = [os.path.join(self.index_dir, name) for name in os.listdir(self.index_dir)
+                 if name.endswith(".json")]
+        if len(files) <= self.max_index_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_index_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
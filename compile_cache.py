@@ -0,0 +1,110 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# Root folder holding one entry directory per cache key
+CACHE_ROOT = os.path.join(tempfile.gettempdir(), "latex_cache")
+
+# Part of every key; bump when a build stores different artifacts so older entries are not restored
+CACHE_FORMAT = 2
+
+
+class FileHasher:
+    # Remembers file digests by (size, mtime) so unchanged figures are not re-read
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, path):
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[path] = (stamp, digest)
+        return digest
+
+
+class CompileCache:
+    def __init__(self, cache_root=CACHE_ROOT, max_bytes=512 * 1024 * 1024):
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.hasher = FileHasher()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_root, exist_ok=True)
+
+    def make_key(self, tex_name, tex_source, dependencies, options=""):
+        # dependencies: iterable of (relative name, absolute path), path None for a missing file
+        h = hashlib.sha256()
+        h.update(f"{CACHE_FORMAT}\0{tex_name}\0{options}\0".encode("utf-8"))
+        h.update(tex_source.encode("utf-8"))
+        for name, path in sorted(dependencies, key=lambda dependency: dependency[0]):
+            digest = self.hasher.digest(path) if path else "missing"
+            h.update(f"\0{name}\0{digest}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_root, key)
+
+    def restore(self, key, target_dir):
+        # Copy the cached artifacts into target_dir; returns the restored names or None on a miss
+        entry = self._entry_dir(key)
+        with self._lock:
+            if not os.path.isdir(entry):
+                return None
+            names = os.listdir(entry)
+            for name in names:
+                shutil.copyfile(os.path.join(entry, name), os.path.join(target_dir, name))
+            # Touch the entry so it counts as recently used
+            os.utime(entry)
+        return names
+
+    def store(self, key, files):
+        # files: paths of the artifacts to keep (PDF, log, ...)
+        entry = self._entry_dir(key)
+        staging = tempfile.mkdtemp(dir=self.cache_root, prefix=".staging-")
+        try:
+            for path in files:
+                if os.path.exists(path):
+                    shutil.copyfile(path, os.path.join(staging, os.path.basename(path)))
+            with self._lock:
+                if os.path.isdir(entry):
+                    shutil.rmtree(entry, ignore_errors=True)
+                os.rename(staging, entry)
+                self._evict()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _entry_size(self, entry):
+        return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_root):
+            entry = os.path.join(self.cache_root, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = self._entry_size(entry)
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.cache_root):
+                shutil.rmtree(os.path.join(self.cache_root, name), ignore_errors=True)
@@ -0,0 +1,539 @@
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from bib_store import BibStore, aux_bibliography
+from compile_cache import CompileCache
+from compile_limits import CompileLimits
+from dependency_graph import project_graph
+from draft_figures import DraftFigures
+from log_parser import MAX_PRINT_LINE, parse_log_file
+from metrics import METRICS
+from pass_scheduler import BuildState, PassScheduler, aux_digest, bib_paths, summarize_source
+from preamble_format import PreambleFormats
+from synctex_index import load_synctex, synctex_path
+
+# Root folder holding one isolated build directory per session
+BUILD_ROOT = os.path.join(tempfile.gettempdir(), "latex_builds")
+
+# Extensions of the files a build of <stem>.tex writes as <stem><ext>
+BUILD_EXTENSIONS = (
+    ".aux", ".log", ".pdf", ".bbl", ".blg", ".out", ".toc", ".fls",
+    ".fdb_latexmk", ".synctex.gz", ".spl", ".lof", ".lot", ".nav", ".snm",
+)
+
+# Captured pdflatex/bibtex output, kept next to the PDF so it can be cached with it
+OUTPUT_LOG = "compile_output.txt"
+
+
+def build_outputs(tex_name):
+    # Names of the files a build of tex_name writes into its build directory. Only these are kept
+    # out of the links to the project: other .pdf, .toc, ... files may be figures or inputs.
+    stem = os.path.splitext(os.path.basename(tex_name))[0]
+    return {stem + ext for ext in BUILD_EXTENSIONS}
+
+
+def find_tex_file(manuscript_dir):
+    # The main .tex file: the root of the project's \input/\include graph (see DependencyGraph.root_file)
+    return project_graph(manuscript_dir).root_file()
+
+
+def pdf_download_name(tex_name, when=None, draft=False):
+    # compiled_<tex stem>_<timestamp>.pdf, the name compiled PDFs are offered under; draft previews
+    # (low-resolution figures) are named draft_... so they are not mistaken for the final PDF
+    when = when or datetime.now()
+    stem = os.path.splitext(os.path.basename(tex_name))[0]
+    prefix = "draft" if draft else "compiled"
+    return f"{prefix}_{stem}_{when.strftime('%Y%m%d_%H%M%S')}.pdf"
+
+
+def section_tex_name(tex_name):
+    # Name single-section previews of tex_name are built under, next to the full document
+    return os.path.splitext(tex_name)[0] + "-section.tex"
+
+
+class CompileQueueFull(RuntimeError):
+    pass
+
+
+class CompileCancelled(RuntimeError):
+    pass
+
+
+class CompileLimitExceeded(RuntimeError):
+    pass
+
+
+class CompileResult:
+    def __init__(self, success, pdf_path, log, returncode, build_dir, cached=False, draft=False):
+        self.success = success
+        self.pdf_path = pdf_path
+        self.log = log
+        self.returncode = returncode
+        self.build_dir = build_dir
+        self.cached = cached
+        # Draft previews run one pass with downsampled figures; not meant for download
+        self.draft = draft
+        # (phase, seconds) in the order they ran, filled in by the engine
+        self.phases = []
+        self.seconds = 0.0
+        self.finished_at = datetime.now()
+        # Errors, warnings, overfull boxes and undefined references read from the .log
+        self.diagnostics = None
+        # Source line <-> page lookups (SynctexIndex) when the build wrote SyncTeX data
+        self.synctex = None
+
+    def read_pdf(self):
+        with open(self.pdf_path, "rb") as f:
+            return f.read()
+
+
+class CompileJob:
+    # Handle on a queued or running compile: streamed output, pass progress and cancellation
+    def __init__(self, session_id, tex_name, tail_lines=2000):
+        self.session_id = session_id
+        self.tex_name = tex_name
+        self.future = None
+        self.status = "Queued"
+        self.current_pass = 0
+        self.planned_passes = 1
+        self.cancelled = False
+        self.phases = []
+        self.submitted = time.perf_counter()
+        self._lines = deque(maxlen=tail_lines)
+        self._process = None
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            raise CompileCancelled("Compilation cancelled.")
+
+    def tail(self, count=40):
+        with self._lock:
+            return list(self._lines)[-count:]
+
+    def progress(self):
+        return min(self.current_pass / max(self.planned_passes, 1), 1.0)
+
+    def set_status(self, status):
+        self.status = status
+        with self._lock:
+            self._lines.append(f"--- {status} ---")
+
+    def start_pass(self, number, planned):
+        self.current_pass = number
+        self.planned_passes = max(planned, number)
+        self.set_status(f"pdflatex pass {number} of {self.planned_passes}")
+
+    @contextmanager
+    def phase(self, name, kind=None):
+        # Times one step of the build; kind groups numbered steps (pdflatex passes) in the metrics
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started, kind)
+
+    def add_phase(self, name, seconds, kind=None):
+        self.phases.append((name, seconds))
+        METRICS.observe("latex_compile_phase_seconds", seconds, phase=kind or name)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+        with self._lock:
+            process = self._process
+        if process is not None:
+            _kill_group(process)
+
+    def run(self, command, cwd, env=None, deadline=None, limits=None):
+        # Run one tool in its own process group under limits, streaming its output line by line.
+        # Whatever is left of the group when the tool exits or hits a limit is killed.
+        if self.cancelled:
+            raise CompileCancelled("Compilation cancelled.")
+        process = subprocess.Popen(limits.wrap(command) if limits is not None else command, cwd=cwd, env=env,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True, errors="replace", start_new_session=True)
+        if limits is not None:
+            limits.apply_to(process.pid)
+        with self._lock:
+            self._process = process
+        if self.cancelled:
+            _kill_group(process)
+        timed_out = threading.Event()
+        timer = None
+        if deadline is not None:
+            def expire():
+                timed_out.set()
+                _kill_group(process)
+            timer = threading.Timer(max(deadline - time.monotonic(), 0), expire)
+            timer.daemon = True
+            timer.start()
+        output = []
+        output_size = 0
+        flooded = False
+        try:
+            with process.stdout:
+                for line in process.stdout:
+                    output_size += len(line)
+                    if limits is not None and limits.output_exceeded(output_size):
+                        # A runaway loop printing to the console; stop it before the log fills memory
+                        if not flooded:
+                            flooded = True
+                            _kill_group(process)
+                        continue
+                    output.append(line)
+                    with self._lock:
+                        self._lines.append(line.rstrip("\n"))
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            # Grandchildren that outlived the tool (or a tool stopped by a limit) go with it
+            _kill_group(process)
+            with self._lock:
+                self._process = None
+        if self.cancelled:
+            raise CompileCancelled("Compilation cancelled.")
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, max(deadline - time.monotonic(), 0))
+        if flooded:
+            raise CompileLimitExceeded(f"{command[0]} stopped: output limit of {limits.output_mb} MB exceeded.")
+        limit = limits.describe(returncode) if limits is not None else None
+        if limit:
+            raise CompileLimitExceeded(f"{command[0]} stopped: {limit} exceeded.")
+        return returncode, "".join(output)
+
+
+def _kill_group(process):
+    # pdflatex/bibtex were started as group leaders; take down the whole tree
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class CompileEngine:
+    def __init__(self, manuscript_dir, max_workers=None, max_queue=16, build_root=BUILD_ROOT,
+                 timeout=120, session_ttl=24 * 3600, cache=None, use_formats=True, use_draft_figures=True,
+                 trim_bibliography=True, limits=None):
+        self.manuscript_dir = os.path.abspath(manuscript_dir)
+        self.cache = cache if cache is not None else CompileCache()
+        # Which project files a document reads; only those are part of its cache key
+        self.graph = project_graph(self.manuscript_dir)
+        # Precompiled preambles, shared by every session with the same preamble
+        self.formats = PreambleFormats(self.manuscript_dir, self.cache.hasher, self.graph) if use_formats else None
+        # Downsampled figures for draft previews; full builds always embed the originals
+        self.draft_figures = DraftFigures(self.manuscript_dir, self.cache.hasher) if use_draft_figures else None
+        # Parsed .bib files: bibtex gets only the cited entries, the editor gets the keys to complete
+        self.bibliography = BibStore()
+        self.trim_bibliography = trim_bibliography
+        self.scheduler = PassScheduler()
+        # What each session's last build depended on, used to skip bibtex and reruns
+        self._build_states = {}
+        self.build_root = build_root
+        # Wall-clock seconds for a whole build; limits caps CPU, memory and output of each tool
+        self.timeout = timeout
+        self.limits = limits if limits is not None else CompileLimits()
+        self.session_ttl = session_ttl
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="latex")
+        # Running plus waiting jobs; submissions beyond this are rejected instead of piling up
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_queue)
+        # Only one job at a time may touch a given session's build directory
+        self._session_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.build_root, exist_ok=True)
+
+    def session_dir(self, session_id):
+        return os.path.join(self.build_root, session_id)
+
+    def submit(self, session_id, tex_name, tex_source, draft=False, xref_from=None):
+        # Returns a CompileJob right away; the build runs on the worker pool. xref_from names the
+        # document (in the same session) whose last .aux/.bbl resolve this one's references, as
+        # for a single section of it.
+        if not self._slots.acquire(blocking=False):
+            raise CompileQueueFull("All compile workers are busy. Please try again shortly.")
+        job = CompileJob(session_id, tex_name)
+        try:
+            job.future = self._executor.submit(self._run, job, tex_name, tex_source, draft, xref_from)
+        except Exception:
+            self._slots.release()
+            raise
+        job.future.add_done_callback(lambda _: self._slots.release())
+        return job
+
+    def compile(self, session_id, tex_name, tex_source, draft=False, xref_from=None):
+        return self.submit(session_id, tex_name, tex_source, draft, xref_from).result()
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _prepare_build_dir(self, build_dir, tex_name, skip=()):
+        os.makedirs(build_dir, exist_ok=True)
+        outputs = build_outputs(tex_name)
+        for name in outputs:
+            # A project file of the same name, linked for another document of the session; the
+            # build would write through the link into the manuscript directory
+            link = os.path.join(build_dir, name)
+            if os.path.islink(link):
+                os.remove(link)
+        # Mirror the shared project files (class, styles, .bib, figures, other .tex inputs)
+        # as symlinks so every session sees them without copying
+        for name in os.listdir(self.manuscript_dir):
+            if name == tex_name or name in skip or name in outputs:
+                continue
+            link = os.path.join(build_dir, name)
+            if os.path.lexists(link):
+                continue
+            os.symlink(os.path.join(self.manuscript_dir, name), link)
+
+    def _dependencies(self, tex_name, tex_source):
+        # The project files the document reads, as (relative name, path) pairs; path is None for
+        # names it reads that are not in the project. Edits to files outside the graph (another
+        # document, notes, unused figures) then leave the cache key alone.
+        graph = self.graph.dependencies(tex_source, tex_name)
+        if graph.complete:
+            return graph.files + [(name, None) for name in graph.missing]
+        # An input name built from macros: fall back to every project file a build can read
+        outputs = build_outputs(tex_name)
+        return [(rel, path) for rel, path in self.graph.project_files() if rel != tex_name and rel not in outputs]
+
+    def _options(self, draft):
+        if draft:
+            return f"draft:{self.draft_figures.signature}" if self.draft_figures else "draft"
+        return ""
+
+    def source_key(self, tex_name, tex_source, draft=False):
+        # The cache key a build of tex_source would have right now; it changes exactly when a file
+        # the document reads does, so callers can tell whether a rebuild would produce anything new
+        return self.cache.make_key(tex_name, tex_source, self._dependencies(tex_name, tex_source),
+                                   options=self._options(draft))
+
+    def _seed_cross_references(self, build_dir, tex_name, xref_from):
+        # Copy the other document's .aux/.bbl in as this one's; returns their digest for the cache key
+        h = hashlib.sha256()
+        for ext in (".aux", ".bbl"):
+            source = os.path.join(build_dir, os.path.splitext(xref_from)[0] + ext)
+            target = os.path.join(build_dir, os.path.splitext(tex_name)[0] + ext)
+            if os.path.exists(source):
+                shutil.copyfile(source, target)
+                h.update(ext.encode("ascii") + self.cache.hasher.digest(source).encode("ascii"))
+            elif os.path.exists(target):
+                os.remove(target)
+        return h.hexdigest()
+
+    def _run(self, job, tex_name, tex_source, draft, xref_from=None):
+        job.add_phase("queue", time.perf_counter() - job.submitted)
+        outcome = "error"
+        try:
+            compile_result = self._compile(job, tex_name, tex_source, draft, xref_from)
+            if compile_result.cached:
+                outcome = "cached"
+            else:
+                outcome = "success" if compile_result.success else "failed"
+        except CompileCancelled:
+            outcome = "cancelled"
+            raise
+        except subprocess.TimeoutExpired:
+            outcome = "timeout"
+            raise
+        except CompileLimitExceeded:
+            outcome = "limit"
+            raise
+        finally:
+            # Measured from submit(), so time spent waiting for a worker counts too
+            seconds = time.perf_counter() - job.submitted
+            METRICS.observe("latex_compile_seconds", seconds, outcome=outcome)
+            METRICS.inc("latex_compiles_total", outcome=outcome)
+        compile_result.phases = list(job.phases)
+        compile_result.seconds = seconds
+        return compile_result
+
+    def _compile(self, job, tex_name, tex_source, draft, xref_from=None):
+        session_id = job.session_id
+        build_dir = self.session_dir(session_id)
+        with self._session_lock(session_id):
+            with job.phase("save"):
+                # The full document is this session's own copy, never a link to the project file
+                self._prepare_build_dir(build_dir, tex_name, skip=(xref_from,) if xref_from else ())
+                os.utime(build_dir)
+                tex_path = os.path.join(build_dir, tex_name)
+                pdf_path = os.path.splitext(tex_path)[0] + ".pdf"
+                tex_log_path = os.path.splitext(tex_path)[0] + ".log"
+                sync_path = synctex_path(pdf_path)
+                output_path = os.path.join(build_dir, OUTPUT_LOG)
+                if os.path.islink(tex_path):
+                    # Writing through a link would overwrite the project's file
+                    os.remove(tex_path)
+                with open(tex_path, "w", encoding="utf-8") as f:
+                    f.write(tex_source)
+                # A .log or .synctex.gz left by the previous build must not be mistaken for this one's
+                for stale_path in (tex_log_path, sync_path):
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+
+            # Identical source and inputs: hand back the stored PDF and log without running pdflatex
+            with job.phase("cache lookup"):
+                options = self._options(draft)
+                if xref_from:
+                    options += ":xref:" + self._seed_cross_references(build_dir, tex_name, xref_from)
+                cache_key = self.cache.make_key(tex_name, tex_source, self._dependencies(tex_name, tex_source),
+                                                options=options)
+                restored = self.cache.restore(cache_key, build_dir)
+            if restored:
+                job.set_status("Loaded from cache")
+                with open(output_path, "r", encoding="utf-8", errors="replace") as f:
+                    log = f.read()
+                compile_result = CompileResult(True, pdf_path, log, 0, build_dir, cached=True, draft=draft)
+            else:
+                build_source = tex_source
+                if draft and self.draft_figures:
+                    # Draft previews embed downsampled copies of large figures instead of the originals
+                    job.set_status("Preparing draft figures")
+                    with job.phase("draft figures"):
+                        build_source, swapped = self.draft_figures.rewrite(tex_source, build_dir)
+                    if swapped:
+                        with open(tex_path, "w", encoding="utf-8") as f:
+                            f.write(build_source)
+                returncode, log = self._build(job, build_dir, tex_name, build_source, draft)
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(log)
+                success = returncode == 0 and os.path.exists(pdf_path)
+                if success:
+                    with job.phase("cache store"):
+                        self.cache.store(cache_key, [pdf_path, output_path, tex_log_path, sync_path])
+                compile_result = CompileResult(success, pdf_path, log, returncode, build_dir, draft=draft)
+            with job.phase("log parse"):
+                compile_result.diagnostics = parse_log_file(tex_log_path)
+            if compile_result.success:
+                with job.phase("synctex index"):
+                    compile_result.synctex = load_synctex(sync_path)
+        self.cleanup_stale_sessions(keep=session_id)
+        return compile_result
+
+    def _build(self, job, build_dir, tex_name, tex_source, draft):
+        stem = os.path.splitext(tex_name)[0]
+        deadline = time.monotonic() + self.timeout
+        # Per document, so a section preview does not replace the full document's state
+        state = self._build_states.setdefault((job.session_id, tex_name), BuildState())
+        summary = summarize_source(tex_source)
+        bibliography = None
+        bib_digest = None
+
+        def run(command, env=None):
+            return job.run(command, build_dir, env=env, deadline=deadline, limits=self.limits)
+
+        # file:line: errors and unwrapped log lines make the .log easy to parse; SyncTeX data links
+        # source lines to pages
+        pdflatex = ["pdflatex", "-interaction=nonstopmode", "-file-line-error", "-synctex=1"]
+        env = dict(os.environ, max_print_line=MAX_PRINT_LINE)
+        fmt_name = None
+        if self.formats:
+            job.set_status("Checking preamble format")
+            with job.phase("preamble format"):
+                fmt_name = self.formats.ensure(build_dir, tex_name, tex_source, run=run)
+        if fmt_name:
+            # Body-only passes: the format already holds the class and packages
+            pdflatex.append(f"-fmt={fmt_name}")
+            env = self.formats.env(env)
+        pdflatex.append(tex_name)
+
+        logs = []
+        # Draft preview: one pass over whatever .aux/.bbl the last build left behind. Whether bibtex
+        # runs is only known after the first pass has written the .aux files.
+        run_bibtex = False
+        planned = self.scheduler.planned_passes(state, summary, run_bibtex, draft)
+        passes = 0
+        while True:
+            aux_before = aux_digest(build_dir, stem)
+            passes += 1
+            job.start_pass(passes, planned)
+            METRICS.inc("latex_pdflatex_passes_total")
+            with job.phase(f"pdflatex pass {passes}", kind="pdflatex"):
+                returncode, output = run(pdflatex, env)
+            logs.append(f"=== pdflatex pass {passes} (planned {planned}) ===\n{output}")
+            if returncode != 0 or draft:
+                break
+            if passes == 1:
+                bibliography = aux_bibliography(build_dir, stem)
+                # The project's .bib files, not the trimmed copies bibtex reads in the build directory
+                bib_digest = "".join(self.cache.hasher.digest(path) for path in
+                                     bib_paths(self.manuscript_dir, bibliography.bib_names if bibliography else ()))
+                run_bibtex = self.scheduler.needs_bibtex(state, bibliography, bib_digest, build_dir, stem)
+                if run_bibtex:
+                    planned = self.scheduler.planned_passes(state, summary, run_bibtex)
+            if run_bibtex:
+                if self.trim_bibliography:
+                    with job.phase("bibliography trim"):
+                        logs.extend(self._trim_bibliographies(build_dir, bibliography))
+                job.set_status("bibtex")
+                with job.phase("bibtex"):
+                    bib_returncode, bib_output = run(["bibtex", stem], env)
+                logs.append(f"=== bibtex ===\n{bib_output}")
+                run_bibtex = False
+                # bibtex exits with 1 on warnings; only real errors stop the build
+                if bib_returncode > 1:
+                    returncode = bib_returncode
+                    break
+                continue
+            if passes >= self.scheduler.max_passes:
+                break
+            if not self.scheduler.needs_rerun(aux_before, aux_digest(build_dir, stem), output):
+                break
+
+        if returncode == 0 and not draft:
+            state.summary = summary
+            state.bibliography = bibliography
+            state.bib_digest = bib_digest
+        return returncode, "\n".join(logs)
+
+    def _trim_bibliographies(self, build_dir, bibliography):
+        # Replace the linked .bib files with copies holding only what the .aux cites, so bibtex
+        # time does not grow with the shared bibliography; returns lines for the build log
+        cited = bibliography.citations
+        notes = []
+        for name in bibliography.bib_names:
+            file_name = name if name.endswith(".bib") else name + ".bib"
+            source = os.path.join(self.manuscript_dir, file_name)
+            # Only project-level .bib files; anything in a subfolder or elsewhere is read as is
+            if os.path.dirname(file_name) or not os.path.isfile(source):
+                continue
+            kept, total = self.bibliography.prepare(source, os.path.join(build_dir, file_name), cited)
+            notes.append(f"=== bibliography: {file_name}, {kept} of {total} entries ===")
+        return notes
+
+    def cleanup_stale_sessions(self, keep=None):
+        # Remove build directories of sessions that have been idle for longer than the TTL
+        cutoff = time.time() - self.session_ttl
+        for name in os.listdir(self.build_root):
+            path = os.path.join(self.build_root, name)
+            if name == keep or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    with self._lock:
+                        self._session_locks.pop(name, None)
+                        for key in [key for key in self._build_states if key[0] == name]:
+                            del self._build_states[key]
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,77 @@
+import os
+import resource
+import shutil
+import signal
+
+MB = 1024 * 1024
+
+# util-linux prlimit, used to start tools with their limits already in place
+PRLIMIT = shutil.which("prlimit")
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class CompileLimits:
+    # Per-process caps for every tool a build runs (pdflatex, bibtex, format dumps), so one
+    # runaway manuscript cannot take the CPU, memory or disk of a shared server. None disables a
+    # limit. Wall-clock time is the engine's timeout, enforced for the whole build.
+    def __init__(self, cpu_seconds=None, memory_mb=None, file_mb=None, output_mb=None):
+        # CPU time of one process; SIGXCPU at the limit, SIGKILL a few seconds later
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else _env_int("LATEX_CPU_SECONDS", 90)
+        # Address space of one process
+        self.memory_mb = memory_mb if memory_mb is not None else _env_int("LATEX_MEMORY_MB", 2048)
+        # Largest file a process may write (PDF, .aux, \openout files); SIGXFSZ beyond it
+        self.file_mb = file_mb if file_mb is not None else _env_int("LATEX_FILE_MB", 512)
+        # Console output a tool may print before it is stopped
+        self.output_mb = output_mb if output_mb is not None else _env_int("LATEX_OUTPUT_MB", 32)
+
+    def _rlimits(self):
+        # (resource, prlimit option, (soft, hard)) for each cap that is set
+        rlimits = []
+        if self.cpu_seconds:
+            rlimits.append((resource.RLIMIT_CPU, "cpu", (self.cpu_seconds, self.cpu_seconds + 5)))
+        if self.memory_mb:
+            rlimits.append((resource.RLIMIT_AS, "as", (self.memory_mb * MB, self.memory_mb * MB)))
+        if self.file_mb:
+            rlimits.append((resource.RLIMIT_FSIZE, "fsize", (self.file_mb * MB, self.file_mb * MB)))
+        # A crashing pdflatex should not drop a core file the size of its address space
+        rlimits.append((resource.RLIMIT_CORE, "core", (0, 0)))
+        return rlimits
+
+    def wrap(self, command):
+        # The command run under prlimit(1), which sets the caps on itself and then execs the tool,
+        # so they hold from the tool's first instruction and for everything it starts. No Python
+        # runs between fork and exec, which would not be safe in the threaded app server.
+        if PRLIMIT is None:
+            return command
+        options = [f"--{name}={soft}:{hard}" for _, name, (soft, hard) in self._rlimits()]
+        return [PRLIMIT, *options, "--", *command]
+
+    def apply_to(self, pid):
+        # Without prlimit(1) the caps are set on the running process instead; whatever it starts
+        # before this call is not covered
+        if PRLIMIT is not None:
+            return
+        for limit, _, values in self._rlimits():
+            try:
+                resource.prlimit(pid, limit, values)
+            except ProcessLookupError:
+                return
+
+    def output_exceeded(self, size):
+        return bool(self.output_mb) and size > self.output_mb * MB
+
+    def describe(self, returncode):
+        # Which limit stopped a process that exited with returncode, or None
+        if returncode == -signal.SIGXCPU:
+            return f"CPU time limit of {self.cpu_seconds} s"
+        if returncode == -signal.SIGKILL:
+            # Cancels, timeouts and the output cap are raised before the return code is looked
+            # at, so this is the hard CPU limit or the kernel running out of memory
+            return f"CPU time limit of {self.cpu_seconds} s or the memory available"
+        if returncode == -signal.SIGXFSZ:
+            return f"file size limit of {self.file_mb} MB"
+        return None
@@ -0,0 +1,279 @@
+import os
+import re
+import subprocess
+import streamlit as st
+from compile_engine import CompileCancelled, CompileLimitExceeded, section_tex_name
+from dependency_graph import project_graph
+from outline_index import section_source
+
+
+def start_compile(engine, tex_name, tex_source, draft=False, xref_from=None):
+    # Only the newest request matters; stop whatever this session still has running
+    job = st.session_state.get("compile_job")
+    if job is not None and not job.done():
+        job.cancel()
+    st.session_state.compile_job = engine.submit(st.session_state.session_id, tex_name, tex_source, draft,
+                                                 xref_from)
+    if xref_from is None:
+        # What this build was of, so a change on disk that leaves it the same does not rebuild
+        st.session_state.last_build_key = engine.source_key(tex_name, tex_source, draft)
+
+
+def take_project_changes(watcher):
+    # Project files changed on disk since this session last looked, as absolute paths
+    generation, changed = watcher.changes_since(st.session_state.get("watch_generation"))
+    st.session_state.watch_generation = generation
+    return changed
+
+
+def sync_from_disk(buffer, tex_path, changed):
+    # Loads tex_path into the editor when another program changed it. Returns "reloaded", "kept"
+    # when the editor has unsaved edits (never overwritten), or None when nothing needed loading.
+    if tex_path not in changed or not os.path.exists(tex_path):
+        return None
+    with open(tex_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text == buffer.saved_text:
+        # Our own save, or a write that changed nothing
+        return None
+    if buffer.unsaved:
+        return "kept"
+    buffer.replace(text)
+    buffer.mark_saved()
+    return "reloaded"
+
+
+def auto_rebuild_needed(engine, tex_name, tex_source, changed, draft=False):
+    # True when project files changed and a build now would differ from the last one requested;
+    # a burst of changes arrives here as one batch, so it queues one build
+    if not changed:
+        return False
+    return engine.source_key(tex_name, tex_source, draft) != st.session_state.get("last_build_key")
+
+
+@st.fragment(run_every=1.0)
+def watch_for_changes(watcher):
+    # Reruns the app once a batch of changes on disk has settled
+    if watcher.generation != st.session_state.get("watch_generation"):
+        st.rerun()
+
+
+def start_section_compile(engine, tex_name, outline, line):
+    # Builds only the top-level section around line (0-based), numbered and cross-referenced from
+    # the last full build of tex_name; returns the section title, or None without \begin{document}
+    span = outline.section_span(line)
+    if span is None:
+        return None
+    start_compile(engine, section_tex_name(tex_name), section_source(outline.text, span), draft=True,
+                  xref_from=tex_name)
+    return span["title"]
+
+
+def compile_running():
+    job = st.session_state.get("compile_job")
+    return job is not None and not job.done()
+
+
+def take_finished_job():
+    # Hand the finished job to the app exactly once
+    job = st.session_state.get("compile_job")
+    if job is not None and job.done():
+        del st.session_state["compile_job"]
+        return job
+    return None
+
+
+def show_compile_failure(error, hint=None):
+    # Message for a finished job whose result() raised; hint is shown after unexpected errors
+    if isinstance(error, CompileCancelled):
+        st.warning("✖ Compilation cancelled.")
+    elif isinstance(error, subprocess.TimeoutExpired):
+        st.error("⏳ Compilation timed out. Please simplify your document or check for errors.")
+    elif isinstance(error, CompileLimitExceeded):
+        st.error(f"🛑 {error} Builds are capped so one document cannot hold up the server.")
+    else:
+        st.error(f"⚠️ Compilation failed: {error}")
+        if hint:
+            st.write(hint)
+
+
+@st.fragment(run_every=0.5)
+def compile_progress(tail_lines=30):
+    # Polls the running job without blocking the rest of the page
+    job = st.session_state.get("compile_job")
+    if job is None:
+        return
+    if job.done():
+        # Rerun the whole app so it can pick up the result
+        st.rerun()
+    st.progress(job.progress(), text=f"⏳ {job.status}")
+    if st.button("✖ Cancel compilation", key="cancel_compile"):
+        job.cancel()
+        st.rerun()
+    st.code("\n".join(job.tail(tail_lines)) or "Waiting for a free compile worker...", language="text")
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+def remember_timings(result, pdf=None):
+    # Keep the finished compile's phase timings (and the PDF load) for the timing panel and status bar
+    phases = list(result.phases)
+    if pdf is not None:
+        phases.append(("PDF load", pdf.load_seconds))
+    st.session_state.compile_timings = phases
+    st.session_state.compile_seconds = result.seconds
+    st.session_state.last_compiled = result.finished_at
+
+
+def show_timings(render_seconds=None):
+    # Per-phase breakdown of the last compile, plus the last page render when there is one
+    phases = list(st.session_state.get("compile_timings") or [])
+    if render_seconds is not None:
+        phases.append(("page render", render_seconds))
+    if not phases:
+        return
+    with st.expander(f"⏱ Timing: {format_seconds(st.session_state.compile_seconds)} total", expanded=False):
+        for name, seconds in phases:
+            st.markdown(f"- {name}: **{format_seconds(seconds)}**")
+
+
+def remember_synctex(tex_name, result):
+    # Line/page lookups for the PDF on screen; kept until the next successful build
+    st.session_state.synctex = (tex_name, result.synctex)
+
+
+def synced_page(line):
+    # Preview page for a 0-based editor line, or None without SyncTeX data
+    tex_name, index = st.session_state.get("synctex") or (None, None)
+    if index is None:
+        return None
+    return index.page_for_line(tex_name, line + 1)
+
+
+def synced_line(page):
+    # 0-based editor line of the first source typeset on page, or None
+    tex_name, index = st.session_state.get("synctex") or (None, None)
+    line = index.line_for_page(page, tex_name) if index is not None else None
+    return None if line is None else line - 1
+
+
+def turn_page(page):
+    # on_change/on_click callback of the preview's page controls: show page and move the editor
+    # to the source typeset on it (callbacks run before the script, so the editor jumps this run)
+    st.session_state.current_page = page
+    line = synced_line(page)
+    if line is not None:
+        st.session_state.selected_line = line
+
+
+def show_thumbnail_strip(thumbnails, pdf, per_row=6):
+    # Clickable page thumbnails; the current page's button is highlighted and pages that changed
+    # in the last build are marked
+    paths = thumbnails.paths(pdf.page_hashes)
+    changed = set(pdf.changed_pages or ())
+    label = "🗂 Pages"
+    if pdf.changed_pages is not None:
+        label += f" ({len(changed)} of {pdf.page_count} changed in the last build)"
+    with st.expander(label, expanded=True):
+        for row in range(0, len(paths), per_row):
+            columns = st.columns(per_row)
+            for index, path in enumerate(paths[row:row + per_row], start=row):
+                with columns[index - row]:
+                    if path is not None:
+                        st.image(path)
+                    else:
+                        st.caption("…")
+                    current = index + 1 == st.session_state.current_page
+                    number = f"✏️ {index + 1}" if index in changed else str(index + 1)
+                    st.button(number, key=f"thumbnail_{index}", on_click=turn_page, args=(index + 1,),
+                              type="primary" if current else "secondary", use_container_width=True)
+        if not thumbnails.done(pdf.pdf_hash):
+            _await_thumbnails(thumbnails, pdf.pdf_hash)
+
+
+@st.fragment(run_every=0.5)
+def _await_thumbnails(thumbnails, pdf_hash):
+    # Polls the worker pool and redraws the strip once every thumbnail is on disk
+    if thumbnails.done(pdf_hash):
+        st.rerun()
+    st.caption("🖼 Rendering page thumbnails...")
+
+
+def show_project_files(manuscript_dir, limit=200):
+    # Summary of the project tree from the shared scan cache; returns the (relative name, path)
+    # list. Only the first limit names are sent to the page, however large the tree grows.
+    files = project_graph(manuscript_dir).project_files()
+    if files:
+        with st.expander(f"📁 {len(files)} files in the manuscript directory"):
+            names = [rel for rel, _ in files[:limit]]
+            if len(files) > limit:
+                names.append(f"… and {len(files) - limit} more")
+            st.text("\n".join(names))
+    return files
+
+
+# Characters Streamlit's markdown (button labels included) would otherwise interpret
+MARKDOWN_SPECIAL_PATTERN = re.compile(r'([\\`*_\[\]<>#|$~])')
+
+
+def _escape_markdown(text):
+    return MARKDOWN_SPECIAL_PATTERN.sub(r'\\\1', text)
+
+
+def show_pdf_search(search, pdf, limit=10):
+    # Full-text search of the PDF on screen; each result turns the preview to its page
+    query = st.text_input("🔎 Search the PDF", key="pdf_search")
+    if not query.strip():
+        return
+    hits = search.search(pdf.pdf_hash, pdf.path, query, limit + 1, pdf.page_hashes)
+    if not hits:
+        st.caption("No matches.")
+        return
+    for page, (before, match, after), _ in hits[:limit]:
+        label = f"p. {page}: {_escape_markdown(before)}**{_escape_markdown(match)}**{_escape_markdown(after)}"
+        st.button(label, key=f"pdf_hit_{page}", on_click=turn_page, args=(page,))
+    if len(hits) > limit:
+        st.caption("More pages match; refine the search to see them.")
+
+
+LOG_ICONS = {"error": "❌", "undefined": "❓", "warning": "⚠️", "overfull": "📏"}
+
+
+def remember_diagnostics(tex_name, result):
+    # Only the parsed records are kept across reruns, not the raw log
+    st.session_state.log_diagnostics = (tex_name, result.diagnostics)
+
+
+def show_log_tail(result, lines=200):
+    tail = result.log.splitlines()[-lines:]
+    with st.expander(f"View raw log (last {len(tail)} lines)", expanded=False):
+        st.code("\n".join(tail), language="text")
+
+
+def show_diagnostics(jump=False, limit=50):
+    # Errors and warnings from the last compile; with jump=True, records in the edited file are
+    # buttons that move the editor cursor to their line through selected_line
+    tex_name, summary = st.session_state.get("log_diagnostics") or (None, None)
+    if summary is None or not summary.entries:
+        return
+    counts = summary.counts
+    label = (f"🔎 Log: {counts['error']} errors, {counts['undefined']} undefined references, "
+             f"{counts['warning']} warnings, {counts['overfull']} overfull boxes")
+    with st.expander(label, expanded=counts["error"] > 0):
+        for i, entry in enumerate(summary.entries[:limit]):
+            where = entry.file or "?"
+            if entry.line:
+                where += f":{entry.line}"
+            text = f"{LOG_ICONS[entry.kind]} {where} — {entry.message}"
+            if jump and entry.line and entry.file == tex_name:
+                # Button labels are Markdown; TeX messages are full of $, _ and backslashes
+                if st.button(_escape_markdown(text), key=f"log_entry_{i}_{entry.line}"):
+                    st.session_state.selected_line = entry.line - 1
+                    st.rerun()
+            else:
+                st.text(text)
+        hidden = sum(counts.values()) - min(len(summary.entries), limit)
+        if hidden > 0:
+            st.caption(f"… and {hidden} more")
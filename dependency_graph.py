@@ -0,0 +1,239 @@
+import os
+import re
+import threading
+from draft_figures import GRAPHICSPATH_PATTERN, INCLUDEGRAPHICS_PATTERN, resolve_graphic
+from pass_scheduler import COMMENT_PATTERN
+
+# What a document can read from the project, by the file type it resolves to
+INPUT_PATTERN = re.compile(r'\\(?:input|include|subfile)\b\s*(?:\{([^}]*)\}|([^\s{}\\%]+))')
+PACKAGE_PATTERN = re.compile(r'\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\]\s*)?\{([^}]*)\}')
+CLASS_PATTERN = re.compile(r'\\(?:documentclass|LoadClass)\s*(?:\[[^\]]*\]\s*)?\{([^}]*)\}')
+BIBLIOGRAPHY_PATTERN = re.compile(r'\\bibliography\s*\{([^}]*)\}')
+BIBRESOURCE_PATTERN = re.compile(r'\\addbibresource\s*(?:\[[^\]]*\]\s*)?\{([^}]*)\}')
+BIBSTYLE_PATTERN = re.compile(r'\\bibliographystyle\s*\{([^}]*)\}')
+# "% !TEX root = main.tex" in a chapter file names the document it belongs to
+MAGIC_ROOT_PATTERN = re.compile(r'^%\s*!TEX\s+root\s*=\s*(.+?)\s*$', re.MULTILINE | re.IGNORECASE)
+DOCUMENTCLASS_PATTERN = re.compile(r'\\documentclass\b')
+BEGIN_DOCUMENT_PATTERN = re.compile(r'\\begin\s*\{document\}')
+# Files that may load more files, so their own references are followed
+SCANNED_EXTENSIONS = (".tex", ".sty", ".cls")
+
+
+class FileReferences:
+    # What one source file reads, as (kind, name) pairs in source order; kind is the extension the
+    # name resolves with (".tex", ".sty", ".cls", ".bib", ".bst") or "graphic"
+    def __init__(self, references, graphics_dirs, is_document, has_body, magic_root):
+        self.references = references
+        self.graphics_dirs = graphics_dirs
+        self.is_document = is_document
+        self.has_body = has_body
+        self.magic_root = magic_root
+
+
+class ProjectDependencies:
+    def __init__(self, files, missing, complete):
+        # (relative name, path) of every project file the document reads
+        self.files = files
+        # Names it reads that are not in the project (yet): packages from the TeX distribution,
+        # or an \input still to be written. Part of the cache key, so the file appearing counts.
+        self.missing = missing
+        # False when an input name is built from macros and could not be followed
+        self.complete = complete
+
+
+def _names(group):
+    return [name.strip() for name in group.split(",") if name.strip()]
+
+
+def scan_references(text):
+    magic = MAGIC_ROOT_PATTERN.search(text[:2000])
+    content = COMMENT_PATTERN.sub("", text)
+    references = []
+    for match in INPUT_PATTERN.finditer(content):
+        references.append((match.start(), ".tex", (match.group(1) or match.group(2)).strip()))
+    for match in PACKAGE_PATTERN.finditer(content):
+        references.extend((match.start(), ".sty", name) for name in _names(match.group(1)))
+    for match in CLASS_PATTERN.finditer(content):
+        references.append((match.start(), ".cls", match.group(1).strip()))
+    for match in BIBLIOGRAPHY_PATTERN.finditer(content):
+        references.extend((match.start(), ".bib", name) for name in _names(match.group(1)))
+    for match in BIBRESOURCE_PATTERN.finditer(content):
+        references.append((match.start(), ".bib", match.group(1).strip()))
+    for match in BIBSTYLE_PATTERN.finditer(content):
+        references.append((match.start(), ".bst", match.group(1).strip()))
+    for match in INCLUDEGRAPHICS_PATTERN.finditer(content):
+        references.append((match.start(), "graphic", match.group(2).strip()))
+    dirs = []
+    for match in GRAPHICSPATH_PATTERN.finditer(content):
+        dirs.extend(d.strip() for d in re.findall(r'\{([^}]*)\}', match.group(1)))
+    references.sort()
+    return FileReferences([(kind, name) for _, kind, name in references if name], dirs,
+                          bool(DOCUMENTCLASS_PATTERN.search(content)), bool(BEGIN_DOCUMENT_PATTERN.search(content)),
+                          magic.group(1) if magic else None)
+
+
+class DependencyGraph:
+    # Follows \input/\include, packages, classes, bibliographies and figures from a document to the
+    # project files it reads. Each file is re-scanned only when its size or mtime changes.
+    def __init__(self, manuscript_dir):
+        self.manuscript_dir = os.path.abspath(manuscript_dir)
+        # path -> ((size, mtime), FileReferences)
+        self._scans = {}
+        # directory -> (mtime, subdirectory names, file names)
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def scan(self, path):
+        stamp = self._stamp(path)
+        with self._lock:
+            cached = self._scans.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            references = scan_references(f.read())
+        with self._lock:
+            self._scans[path] = (stamp, references)
+        return references
+
+    def _listing(self, directory):
+        # A directory's mtime changes whenever an entry is added, removed or renamed in it, so its
+        # listing is read again only then
+        mtime = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        dirs = []
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Like os.walk, symlinked directories are listed but not followed
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif not entry.is_dir():
+                    files.append(entry.name)
+        dirs.sort()
+        files.sort()
+        with self._lock:
+            self._listings[directory] = (mtime, dirs, files)
+        return dirs, files
+
+    def project_files(self):
+        # Every file in the project as (relative name, path), depth first like os.walk; costs one
+        # stat per directory when nothing was added or removed since the last call
+        found = []
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            directory = os.path.join(self.manuscript_dir, rel_dir) if rel_dir else self.manuscript_dir
+            try:
+                dirs, files = self._listing(directory)
+            except FileNotFoundError:
+                continue
+            for name in files:
+                rel = os.path.join(rel_dir, name) if rel_dir else name
+                found.append((rel, os.path.join(directory, name)))
+            pending.extend(os.path.join(rel_dir, name) if rel_dir else name for name in reversed(dirs))
+        return found
+
+    def _resolve(self, kind, name):
+        # Path of the project file name refers to, or None. TeX resolves every name against the
+        # build directory, which mirrors the project, whichever file the reference is in.
+        if kind == ".tex":
+            candidates = [name + ".tex", name] if not name.endswith(".tex") else [name]
+        else:
+            candidates = [name if name.endswith(kind) else name + kind]
+        for candidate in candidates:
+            path = os.path.normpath(os.path.join(self.manuscript_dir, candidate))
+            if os.path.isfile(path) and path.startswith(self.manuscript_dir + os.sep):
+                return path
+        return None
+
+    def dependencies(self, tex_source, tex_name=None):
+        # Everything tex_source (the edited text of tex_name) reads from the project
+        root_path = os.path.join(self.manuscript_dir, tex_name) if tex_name else None
+        files = {}
+        missing = set()
+        complete = True
+        graphics = []
+        dirs = [""]
+        pending = [(root_path, scan_references(tex_source))]
+        seen = {root_path}
+        while pending:
+            path, scanned = pending.pop()
+            in_document = path is None or path == root_path or path.endswith(".tex")
+            dirs.extend(scanned.graphics_dirs)
+            for kind, name in scanned.references:
+                if "\\" in name or "#" in name:
+                    # Built from macros (or a macro's own parameter inside a package). Only a
+                    # document's own input is a real file the graph cannot know.
+                    if in_document:
+                        complete = False
+                    continue
+                if kind == "graphic":
+                    graphics.append(name)
+                    continue
+                target = self._resolve(kind, name)
+                if target is None:
+                    missing.add(name if name.endswith(kind) or kind == ".tex" else name + kind)
+                    continue
+                if target == root_path:
+                    continue
+                files[os.path.relpath(target, self.manuscript_dir)] = target
+                if target.endswith(SCANNED_EXTENSIONS) and target not in seen:
+                    seen.add(target)
+                    pending.append((target, self.scan(target)))
+        # \graphicspath applies to every figure once set, so figures are resolved last
+        for name in graphics:
+            target = resolve_graphic(self.manuscript_dir, name, dirs)
+            if target is None:
+                missing.add(name)
+            else:
+                files[os.path.relpath(target, self.manuscript_dir)] = target
+        return ProjectDependencies(sorted(files.items()), sorted(missing), complete)
+
+    def root_file(self):
+        # The document to compile: a top-level .tex with \documentclass that no other file inputs,
+        # preferring one with a body; a "% !TEX root" comment in any file wins. None without .tex files.
+        names = [name for name in self._listing(self.manuscript_dir)[1] if name.endswith(".tex")]
+        if not names:
+            return None
+        scans = {name: self.scan(os.path.join(self.manuscript_dir, name)) for name in names}
+        for name in names:
+            magic = scans[name].magic_root
+            if magic:
+                target = self._resolve(".tex", magic)
+                if target is not None and os.path.dirname(target) == self.manuscript_dir:
+                    return target
+        included = set()
+        inputs = dict.fromkeys(names, 0)
+        for name, scanned in scans.items():
+            for kind, reference in scanned.references:
+                if kind == ".tex":
+                    target = self._resolve(kind, reference)
+                    if target is not None:
+                        included.add(os.path.relpath(target, self.manuscript_dir))
+                        inputs[name] += 1
+        # Standalone figure or letter documents sit next to the paper too; the paper is the one
+        # pulling in the most files
+        documents = [name for name in names if scans[name].is_document]
+        ranked = sorted(documents, key=lambda name: (name in included, not scans[name].has_body, -inputs[name]))
+        return os.path.join(self.manuscript_dir, ranked[0] if ranked else names[0])
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def project_graph(manuscript_dir):
+    # One graph (and scan cache) per project directory, shared by the apps and compile engines
+    manuscript_dir = os.path.abspath(manuscript_dir)
+    with _graphs_lock:
+        graph = _graphs.get(manuscript_dir)
+        if graph is None:
+            graph = _graphs[manuscript_dir] = DependencyGraph(manuscript_dir)
+        return graph
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import struct
+import tempfile
+import threading
+from pass_scheduler import COMMENT_PATTERN
+from pdf_documents import FITZ_LOCK
+
+# Shared folder of downsampled figures, one file per source image and draft setting
+FIGURE_ROOT = os.path.join(tempfile.gettempdir(), "latex_draft_figures")
+
+# Build-directory folder linking the downsampled figures a draft build uses
+DRAFT_FIGURE_DIR = "_draft_figures"
+
+# Longest side of a draft figure in pixels: about 180 dpi across a full text width
+DRAFT_MAX_PIXELS = 1200
+DRAFT_JPEG_QUALITY = 75
+# Bump when the downsampling changes so older files and cached draft PDFs are not reused
+DRAFT_FIGURE_VERSION = 1
+
+INCLUDEGRAPHICS_PATTERN = re.compile(r'(\\includegraphics\*?\s*(?:\[[^\]]*\]\s*)?\{)([^}]*)(\})')
+GRAPHICSPATH_PATTERN = re.compile(r'\\graphicspath\s*\{((?:\s*\{[^}]*\})+)\s*\}')
+# pdflatex tries these, in order, for a target without a known extension
+GRAPHICS_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".PDF", ".PNG", ".JPG", ".JPEG")
+RASTER_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Resolution pdflatex assumes for images that do not state one
+DEFAULT_DPI = 72
+
+
+def graphics_dirs(tex_source):
+    # "" (the build directory) first, then the \graphicspath entries
+    dirs = [""]
+    match = GRAPHICSPATH_PATTERN.search(COMMENT_PATTERN.sub("", tex_source))
+    if match:
+        dirs.extend(d.strip() for d in re.findall(r'\{([^}]*)\}', match.group(1)))
+    return dirs
+
+
+def resolve_graphic(base_dir, target, dirs):
+    # The file \includegraphics{target} would load, or None if it is not in the project
+    names = [target]
+    if not target.endswith(GRAPHICS_EXTENSIONS):
+        names = [target + ext for ext in GRAPHICS_EXTENSIONS]
+    for directory in dirs:
+        for name in names:
+            path = os.path.join(base_dir, directory, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def image_dpi(path):
+    # The resolution pdflatex sizes the image by: JFIF density or PNG pHYs, else 72 dpi.
+    # Other metadata (EXIF) is ignored by pdflatex, so it is ignored here too.
+    with open(path, "rb") as f:
+        head = f.read(8)
+        if head[:4] == b"\xff\xd8\xff\xe0":
+            # SOI, APP0 marker and length, then "JFIF\0", version, units and x/y density
+            app0 = head + f.read(10)
+            if app0[6:11] == b"JFIF\0" and len(app0) == 18:
+                units = app0[13]
+                x, y = struct.unpack(">HH", app0[14:18])
+                if units == 1 and x and y:
+                    return x, y
+                if units == 2 and x and y:
+                    return x * 2.54, y * 2.54
+        elif head == b"\x89PNG\r\n\x1a\n":
+            # pHYs has to come before the image data
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    break
+                length, kind = struct.unpack(">I4s", chunk)
+                if kind == b"pHYs":
+                    x, y, unit = struct.unpack(">IIB", f.read(9))
+                    if unit == 1 and x and y:
+                        return x * 0.0254, y * 0.0254
+                    break
+                if kind == b"IDAT":
+                    break
+                f.seek(length + 4, os.SEEK_CUR)
+    return DEFAULT_DPI, DEFAULT_DPI
+
+
+class DraftFigures:
+    # Low-resolution stand-ins for large raster figures, used only by draft previews
+    def __init__(self, manuscript_dir, hasher, figure_root=FIGURE_ROOT, max_pixels=DRAFT_MAX_PIXELS,
+                 jpeg_quality=DRAFT_JPEG_QUALITY):
+        self.manuscript_dir = manuscript_dir
+        self.hasher = hasher
+        self.figure_root = figure_root
+        self.max_pixels = max_pixels
+        self.jpeg_quality = jpeg_quality
+        # Part of the compile cache key of draft builds
+        self.signature = f"{max_pixels}px-q{jpeg_quality}-v{DRAFT_FIGURE_VERSION}"
+        # Keys of images already small enough, so they are not decoded again
+        self._small = set()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.figure_root, exist_ok=True)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def preview_path(self, path):
+        # Downsampled copy of the image at path, made on first use; None when the original is small enough
+        digest = self.hasher.digest(path)
+        key = hashlib.sha256(f"{digest}\0{self.signature}".encode("utf-8")).hexdigest()[:16]
+        if key in self._small:
+            return None
+        for ext in (".jpg", ".png"):
+            existing = os.path.join(self.figure_root, key + ext)
+            if os.path.exists(existing):
+                return existing
+        with self._key_lock(key):
+            for ext in (".jpg", ".png"):
+                existing = os.path.join(self.figure_root, key + ext)
+                if os.path.exists(existing):
+                    return existing
+            # PyMuPDF decodes and resamples the images; loaded only once a draft needs it
+            import fitz
+            with FITZ_LOCK:
+                try:
+                    pix = fitz.Pixmap(path)
+                except Exception:
+                    # Not an image MuPDF can read; pdflatex gets the original
+                    self._small.add(key)
+                    return None
+                longest = max(pix.width, pix.height)
+                if longest <= self.max_pixels:
+                    self._small.add(key)
+                    return None
+                if pix.colorspace is not None and pix.colorspace.n not in (1, 3):
+                    pix = fitz.Pixmap(fitz.csRGB, pix)
+                scale = self.max_pixels / longest
+                x_dpi, y_dpi = image_dpi(path)
+                # Whole-number dpi (JFIF/pHYs store integers); the pixel size follows from it so the
+                # figure keeps its natural size and layouts using scale= do not move
+                new_x_dpi = max(round(x_dpi * scale), 1)
+                new_y_dpi = max(round(y_dpi * scale), 1)
+                width = max(round(pix.width * new_x_dpi / x_dpi), 1)
+                height = max(round(pix.height * new_y_dpi / y_dpi), 1)
+                small = fitz.Pixmap(pix, width, height, None)
+                small.set_dpi(new_x_dpi, new_y_dpi)
+                # Keep transparency as PNG; everything else becomes a JPEG
+                if small.alpha:
+                    ext, data = ".png", small.tobytes("png")
+                else:
+                    ext, data = ".jpg", small.tobytes("jpeg", jpg_quality=self.jpeg_quality)
+            preview = os.path.join(self.figure_root, key + ext)
+            tmp_path = f"{preview}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, preview)
+        return preview
+
+    def rewrite(self, tex_source, build_dir):
+        # Point every large raster \includegraphics at its downsampled copy, linked under
+        # build_dir/_draft_figures. Returns the rewritten source and how many figures were swapped.
+        dirs = graphics_dirs(tex_source)
+        link_dir = os.path.join(build_dir, DRAFT_FIGURE_DIR)
+        swapped = 0
+
+        def replace(match):
+            nonlocal swapped
+            line_start = tex_source.rfind("\n", 0, match.start()) + 1
+            if COMMENT_PATTERN.search(tex_source, line_start, match.start()):
+                return match.group(0)
+            path = resolve_graphic(self.manuscript_dir, match.group(2).strip(), dirs)
+            if path is None or not path.lower().endswith(RASTER_EXTENSIONS):
+                return match.group(0)
+            preview = self.preview_path(path)
+            if preview is None:
+                return match.group(0)
+            name = os.path.basename(preview)
+            link = os.path.join(link_dir, name)
+            if not os.path.lexists(link):
+                os.makedirs(link_dir, exist_ok=True)
+                os.symlink(preview, link)
+            swapped += 1
+            return f"{match.group(1)}{DRAFT_FIGURE_DIR}/{name}{match.group(3)}"
+
+        return INCLUDEGRAPHICS_PATTERN.sub(replace, tex_source), swapped
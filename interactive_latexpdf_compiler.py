@@ -1,12 +1,22 @@
 import streamlit as st
 import os
-import subprocess
-from datetime import datetime
-import re
+import time
+import uuid
 import base64
-from streamlit_ace import st_ace
-import tempfile
-import fitz  # PyMuPDF for PDF rendering
+from bib_store import bib_files
+from compile_engine import CompileEngine, CompileQueueFull, find_tex_file, pdf_download_name, section_tex_name
+from compile_ui import (compile_progress, compile_running, format_seconds, remember_diagnostics,
+                        remember_timings, show_diagnostics, show_log_tail, show_timings, start_compile,
+                        remember_synctex, show_pdf_search, show_thumbnail_strip, start_section_compile, synced_page,
+                        take_finished_job, turn_page, take_project_changes, sync_from_disk,
+                        auto_rebuild_needed, watch_for_changes, show_compile_failure)
+from outline_index import OutlineIndex
+from page_renderer import PageRenderer
+from page_thumbnails import PageThumbnails
+from pdf_documents import PdfDocumentManager
+from pdf_search import PdfSearch
+from project_watcher import ProjectWatcher
+from synced_editor import EditorBuffer, pull_edits, synced_editor
 
 # Streamlit page configuration
 st.set_page_config(page_title="LaTeX Compiler", layout="wide")
@@ -24,52 +34,89 @@ if not os.path.exists(manuscript_dir):
     st.error("❌ Created manuscript directory as it didn't exist. Please add your .tex file.")
     st.stop()
 
-# Load first .tex file found
-tex_files = [f for f in os.listdir(manuscript_dir) if f.endswith(".tex")]
-if not tex_files:
+# Load the main .tex file
+tex_file_path = find_tex_file(manuscript_dir)
+if not tex_file_path:
     st.error("❌ No `.tex` file found in `manuscript/`. Please add your main .tex file.")
     st.stop()
 
-tex_file_path = os.path.join(manuscript_dir, tex_files[0])
-
-# Read initial .tex content
-with open(tex_file_path, "r", encoding="utf-8") as f:
-    tex_content = f.read()
-
-# Extract TOC from LaTeX with more comprehensive pattern
-def extract_toc_lines(content):
-    toc = []
-    pattern = re.compile(r'\\(part|chapter|section|subsection|subsubsection|paragraph|subparagraph)\*?\s*{([^}]*)}')
-    for i, line in enumerate(content.splitlines()):
-        match = pattern.search(line)
-        if match:
-            level, title = match.group(1), match.group(2)
-            toc.append({
-                "title": title, 
-                "line": i, 
-                "level": level
-            })
-    return toc
+# One compile engine (and worker pool) shared by every session of this app
+@st.cache_resource
+def get_compile_engine(manuscript_dir):
+    return CompileEngine(manuscript_dir)
+
+# Compiled PDFs live on disk; the handles pages are rendered from share one memory budget
+@st.cache_resource
+def get_pdf_documents():
+    return PdfDocumentManager()
+
+# Rendered pages are cached (and neighbours prefetched) across reruns and sessions
+@st.cache_resource
+def get_page_renderer():
+    return PageRenderer(get_pdf_documents())
+
+# Text indexes of compiled PDFs, built in the background and shared across sessions
+@st.cache_resource
+def get_pdf_search():
+    return PdfSearch()
+
+# Page thumbnails are rendered by a process pool after each build and kept on disk
+@st.cache_resource
+def get_page_thumbnails():
+    return PageThumbnails()
+
+# One watcher on the project directory, shared by every session of this app
+@st.cache_resource
+def get_project_watcher(manuscript_dir):
+    return ProjectWatcher(manuscript_dir)
 
 # Session state initialization
-if 'pdf_data' not in st.session_state:
-    st.session_state.pdf_data = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if 'pdf_filename' not in st.session_state:
     st.session_state.pdf_filename = None
+if 'pdf_hash' not in st.session_state:
+    st.session_state.pdf_hash = None
 if 'selected_line' not in st.session_state:
-    st.session_state.selected_line = 0
+    st.session_state.selected_line = None
 if 'current_page' not in st.session_state:
     st.session_state.current_page = 1
 if 'total_pages' not in st.session_state:
     st.session_state.total_pages = 1
-if 'tex_content' not in st.session_state:
-    st.session_state.tex_content = tex_content
-if 'doc' not in st.session_state:
-    st.session_state.doc = None
+# Editor cursor line the preview last followed
+if 'synced_cursor' not in st.session_state:
+    st.session_state.synced_cursor = None
+# The .tex file is read once per session; afterwards the editor sends only its changes
+if 'editor_buffer' not in st.session_state:
+    with open(tex_file_path, "r", encoding="utf-8") as f:
+        st.session_state.editor_buffer = EditorBuffer(f.read())
+# The outline is kept per session and re-scanned only around each edit
+if 'outline' not in st.session_state:
+    st.session_state.outline = OutlineIndex(manuscript_dir)
+    st.session_state.outline.update(st.session_state.editor_buffer.text)
+if 'jumped_section' not in st.session_state:
+    st.session_state.jumped_section = None
+
+# Apply the edits from the browser before building the dropdown
+for start, end, replacement, text in pull_edits(st.session_state.editor_buffer, "tex_editor"):
+    st.session_state.outline.apply_edit(start, end, replacement, text)
+
+# Files changed on disk (by another editor, a script, git) since this session's last run. The
+# open document is reloaded unless it has unsaved edits here, so the browser's edits come first.
+project_changes = take_project_changes(get_project_watcher(manuscript_dir))
+disk_sync = sync_from_disk(st.session_state.editor_buffer, tex_file_path, project_changes)
+if disk_sync == "reloaded":
+    st.session_state.outline.update(st.session_state.editor_buffer.text)
+else:
+    # Builds use the editor's text, so the file on disk only matters once it is loaded
+    project_changes.discard(tex_file_path)
 
 # Extract TOC items for the dropdown
-toc_items = extract_toc_lines(st.session_state.tex_content)
-section_options = ["-- Select Section --"] + [f"{item['title']} (line {item['line']+1})" for item in toc_items]
+toc_items = st.session_state.outline.outline()
+section_options = ["-- Select Section --"] + [
+    f"{item['title']}{' [' + item['file'] + ']' if 'file' in item else ''} (line {item['line']+1})"
+    for item in toc_items
+]
 
 # Wide LaTeX Editor at the top
 st.subheader("✍️ LaTeX Editor")
@@ -86,40 +133,48 @@ with col_dropdown:
         label_visibility="collapsed"
     )
     
-    # Process section selection
-    if selected_section != "-- Select Section --":
+    # Process section selection (once, so later reruns do not pull the cursor back)
+    if selected_section != "-- Select Section --" and selected_section != st.session_state.jumped_section:
         # Extract line number from the selected option
         line_num = int(selected_section.split("(line ")[1].rstrip(")")) - 1
         st.session_state.selected_line = line_num
+        st.session_state.current_page = synced_page(line_num) or st.session_state.current_page
+    st.session_state.jumped_section = selected_section
 
-# LaTeX editor with cursor positioning
-editor_args = {
-    "value": st.session_state.tex_content,
-    "language": "latex",
-    "theme": "monokai",
-    "key": "tex_editor",
-    "height": 500,  # Wider than tall
-    "auto_update": True,
-    "font_size": 14,
-    "wrap": True
-}
-
-edited_tex = st_ace(**editor_args)
+# LaTeX editor with cursor positioning; changes are sent after a pause in typing
+synced_editor(
+    st.session_state.editor_buffer,
+    key="tex_editor",
+    height=500,  # Wider than tall
+    theme="monokai",
+    font_size=14,
+    wrap=True,
+    goto_line=st.session_state.selected_line,
+    # Keys from the project's .bib files, offered while typing inside \cite{...}
+    citations_url=get_compile_engine(manuscript_dir).bibliography.index_url(bib_files(manuscript_dir))
+)
+st.session_state.selected_line = None  # Reset after jump
+edited_tex = st.session_state.editor_buffer.text
 
-# Update session state if content changes
-if edited_tex != st.session_state.tex_content:
-    st.session_state.tex_content = edited_tex
+# The preview follows the editor cursor whenever it moves
+cursor_line = st.session_state.editor_buffer.cursor_line
+if cursor_line is not None and cursor_line != st.session_state.synced_cursor:
+    st.session_state.synced_cursor = cursor_line
+    st.session_state.current_page = synced_page(cursor_line) or st.session_state.current_page
 
 # Save and compile options below the editor
 st.subheader("🛠 Compilation Controls")
-auto_compile = st.checkbox("🔁 Auto-compile after saving", value=True)
+auto_compile = st.checkbox("🔁 Auto-compile after saving or when project files change", value=True)
+draft_preview = st.checkbox("⚡ Draft preview (single pass, no bibtex, low-res figures)", value=False)
 compile_triggered = False
+section_triggered = False
 
-col_save, col_compile = st.columns(2)
+col_save, col_compile, col_section = st.columns(3)
 with col_save:
     if st.button("💾 Save Changes", use_container_width=True):
         with open(tex_file_path, "w", encoding="utf-8") as f:
             f.write(edited_tex)
+        st.session_state.editor_buffer.mark_saved()
         st.success("✅ Changes saved.")
         if auto_compile:
             compile_triggered = True
@@ -128,75 +183,114 @@ with col_compile:
     if st.button("🛠 Compile LaTeX", use_container_width=True):
         compile_triggered = True
 
+with col_section:
+    # Just the section the editor cursor is in, for a quick look at one part of a long document
+    if st.button("🎯 Compile Section", use_container_width=True,
+                 help="Compile only the section around the cursor, with numbers and references from the last full build"):
+        section_triggered = True
+
+if disk_sync == "reloaded":
+    st.info(f"🔄 {os.path.basename(tex_file_path)} changed on disk and was reloaded.")
+elif disk_sync == "kept":
+    st.warning(f"⚠️ {os.path.basename(tex_file_path)} changed on disk; your unsaved edits were kept. "
+               "Saving will overwrite the version on disk.")
+# Rebuild once per settled burst of changes on disk, and only when the document actually reads
+# one of the changed files; a newer build replaces one still running
+if (auto_compile and not compile_triggered and not section_triggered
+        and auto_rebuild_needed(get_compile_engine(manuscript_dir), os.path.basename(tex_file_path), edited_tex,
+                                project_changes, draft=draft_preview)):
+    compile_triggered = True
+    st.info(f"🔁 {len(project_changes)} project file(s) changed, rebuilding.")
+
 if compile_triggered:
     try:
-        # Save edited content before compiling
-        with open(tex_file_path, "w", encoding="utf-8") as f:
-            f.write(edited_tex)
-        
-        # Compile with latexmk
-        with st.spinner("⏳ Compiling LaTeX document..."):
-            result = subprocess.run(
-                ["latexmk", "-pdf", "-pdflatex=pdflatex", "-interaction=nonstopmode", tex_file_path],
-                cwd=manuscript_dir,
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
-            
-            pdf_path = os.path.splitext(tex_file_path)[0] + ".pdf"
-            if result.returncode == 0 and os.path.exists(pdf_path):
-                with open(pdf_path, "rb") as f:
-                    st.session_state.pdf_data = f.read()
-                st.session_state.pdf_filename = f"compiled_{os.path.basename(os.path.splitext(tex_file_path)[0])}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-                st.success("✅ PDF compiled successfully!")
-                
-                # Load PDF for navigation
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                    tmp_file.write(st.session_state.pdf_data)
-                    tmp_path = tmp_file.name
-                
-                if st.session_state.doc:
-                    st.session_state.doc.close()
-                st.session_state.doc = fitz.open(tmp_path)
-                st.session_state.total_pages = st.session_state.doc.page_count
-                st.session_state.current_page = 1
+        # Queue the edited content for this session's own build directory
+        engine = get_compile_engine(manuscript_dir)
+        start_compile(engine, os.path.basename(tex_file_path), edited_tex, draft=draft_preview)
+    except CompileQueueFull as busy:
+        st.error(f"⏳ {busy}")
+elif section_triggered:
+    try:
+        engine = get_compile_engine(manuscript_dir)
+        section_title = start_section_compile(engine, os.path.basename(tex_file_path), st.session_state.outline,
+                                              st.session_state.editor_buffer.cursor_line or 0)
+        if section_title is None:
+            st.error("❌ No \\begin{document} found, so there is no section to compile.")
+        else:
+            st.info(f"🎯 Compiling section: {section_title}")
+    except CompileQueueFull as busy:
+        st.error(f"⏳ {busy}")
+
+# Live log and Cancel button while the build runs in the background
+if compile_running():
+    compile_progress()
+
+finished_job = take_finished_job()
+if finished_job is not None:
+    try:
+        result = finished_job.result()
+        remember_diagnostics(finished_job.tex_name, result)
+        if result.success:
+            # Keep an immutable copy of the build output and open it from disk
+            pdf = get_pdf_documents().adopt(st.session_state.session_id, result.pdf_path)
+            remember_timings(result, pdf)
+            remember_synctex(finished_job.tex_name, result)
+            get_pdf_search().submit(pdf.pdf_hash, pdf.path, pdf.page_hashes)
+            get_page_thumbnails().submit(pdf.pdf_hash, pdf.path, pdf.page_hashes)
+            st.session_state.pdf_hash = pdf.pdf_hash
+            st.session_state.pdf_filename = pdf_download_name(finished_job.tex_name, draft=result.draft)
+            if finished_job.tex_name == section_tex_name(os.path.basename(tex_file_path)):
+                st.success("✅ Section compiled. Numbers and references come from the last full build.")
             else:
-                st.error("❌ Compilation failed.")
-                with st.expander("View Compilation Log", expanded=False):
-                    st.code(result.stdout + result.stderr, language="text")
-    except subprocess.TimeoutExpired:
-        st.error("⏳ Compilation timed out. Please try again.")
-    except Exception as e:
-        st.error(f"⚠️ Unexpected error: {str(e)}")
+                st.success("✅ Sources unchanged, PDF loaded from cache." if result.cached else "✅ PDF compiled successfully!")
+            
+            st.session_state.total_pages = pdf.page_count
+            # Stay where the cursor is instead of going back to page 1
+            cursor_page = synced_page(st.session_state.editor_buffer.cursor_line or 0)
+            st.session_state.current_page = min(cursor_page or 1, pdf.page_count)
+        else:
+            st.error("❌ Compilation failed.")
+            show_log_tail(result)
+    except Exception as error:
+        show_compile_failure(error)
+
+# Errors and warnings from the last build; clicking one moves the editor cursor there
+show_diagnostics(jump=True)
 
 # PDF Viewer below everything
 st.subheader("📄 PDF Preview")
 
-if st.session_state.pdf_data and st.session_state.doc:
+pdf = get_pdf_documents().get(st.session_state.session_id)
+if pdf is not None:
     # Page navigation controls
     col_page1, col_page2 = st.columns([1, 3])
     with col_page1:
         st.markdown(f"**Page {st.session_state.current_page} of {st.session_state.total_pages}**")
+    with col_page2:
+        show_pdf_search(get_pdf_search(), pdf)
     
-    # Navigation buttons
+    # Navigation buttons; turning the page also moves the editor to the page's source
     col_prev, col_next, col_jump = st.columns([1, 1, 3])
     with col_prev:
-        if st.button("◀ Previous Page", use_container_width=True) and st.session_state.current_page > 1:
-            st.session_state.current_page -= 1
+        st.button("◀ Previous Page", use_container_width=True, on_click=turn_page,
+                  args=(max(st.session_state.current_page - 1, 1),))
     with col_next:
-        if st.button("Next Page ▶", use_container_width=True) and st.session_state.current_page < st.session_state.total_pages:
-            st.session_state.current_page += 1
+        st.button("Next Page ▶", use_container_width=True, on_click=turn_page,
+                  args=(min(st.session_state.current_page + 1, st.session_state.total_pages),))
     with col_jump:
         jump_page = st.number_input("Jump to page", min_value=1, max_value=st.session_state.total_pages, value=st.session_state.current_page)
-        if st.button("Go", use_container_width=True) and jump_page != st.session_state.current_page:
-            st.session_state.current_page = jump_page
+        st.button("Go", use_container_width=True, on_click=turn_page, args=(jump_page,))
+    
+    # Every page at a glance; clicking one turns to it
+    show_thumbnail_strip(get_page_thumbnails(), pdf, per_row=10)
     
     # Render the selected page
     try:
-        page = st.session_state.doc.load_page(st.session_state.current_page - 1)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        img_bytes = pix.tobytes("png")
+        started = time.perf_counter()
+        img_bytes = get_page_renderer().render(
+            pdf.pdf_hash, pdf.path, st.session_state.current_page - 1, page_hashes=pdf.page_hashes
+        )
+        st.session_state.render_seconds = time.perf_counter() - started
         
         # Display the page with caption
         st.image(
@@ -210,7 +304,7 @@ if st.session_state.pdf_data and st.session_state.doc:
     # Download button
     st.download_button(
         "📥 Download PDF", 
-        st.session_state.pdf_data, 
+        pdf.read_bytes(), 
         file_name=st.session_state.pdf_filename, 
         mime="application/pdf",
         use_container_width=True
@@ -219,26 +313,15 @@ else:
     st.info("🛈 PDF not compiled yet. Click **Compile LaTeX** or save with auto-compile enabled.")
     st.image("https://via.placeholder.com/1200x600?text=PDF+Preview+Area", use_column_width=True)
 
-# JavaScript for cursor positioning
-if st.session_state.selected_line > 0:
-    js_code = f"""
-    <script>
-        setTimeout(() => {{
-            const editor = document.querySelector('.ace_editor').env.editor;
-            editor.gotoLine({st.session_state.selected_line + 1});
-            editor.focus();
-            window.scrollTo(0, 0);
-        }}, 100);
-    </script>
-    """
-    st.components.v1.html(js_code, height=0)
-    st.session_state.selected_line = 0  # Reset after jump
-
 # Status bar at bottom
 st.markdown("---")
-if st.session_state.pdf_data:
-    st.caption(f"📄 Last compiled: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | "
+# Picks up changes on disk while nobody interacts with the page
+watch_for_changes(get_project_watcher(manuscript_dir))
+if st.session_state.pdf_hash:
+    st.caption(f"📄 Last compiled: {st.session_state.last_compiled.strftime('%Y-%m-%d %H:%M:%S')} "
+               f"in {format_seconds(st.session_state.compile_seconds)} | "
                f"Editing: {os.path.basename(tex_file_path)} | "
                f"Pages: {st.session_state.total_pages}")
+    show_timings(st.session_state.get("render_seconds"))
 else:
     st.caption(f"📄 Ready to compile | Editing: {os.path.basename(tex_file_path)}")
@@ -0,0 +1,153 @@
+import os
+import re
+
+# pdflatex writes long lines unwrapped when max_print_line is raised, which keeps file names and
+# messages on one line for the parser
+MAX_PRINT_LINE = "10000"
+
+# "./main.tex:42: Undefined control sequence." (-file-line-error) and "! Undefined control sequence."
+FILE_LINE_ERROR_PATTERN = re.compile(r'^(\S+\.\w+):(\d+): (.*)$')
+ERROR_PATTERN = re.compile(r'^! (.*)$')
+# "l.42 \foo" marks where TeX stopped reading
+ERROR_LINE_PATTERN = re.compile(r'^l\.(\d+)(.*)$')
+WARNING_PATTERN = re.compile(r'^((?:LaTeX|LaTeX Font|Package \S+|Class \S+) Warning): (.*)$')
+# Package warnings continue on lines starting with "(package)"
+CONTINUATION_PATTERN = re.compile(r'^\((\S+)\)\s+(.*)$')
+INPUT_LINE_PATTERN = re.compile(r'on input line (\d+)')
+UNDEFINED_PATTERN = re.compile(r"(Reference|Citation) [`']([^']*)' on page \S+ undefined")
+OVERFULL_PATTERN = re.compile(r'^Overfull \\[hv]box \((\S+) too (?:wide|high)\)(?:.*? at lines? (\d+))?')
+# "(./main.tex" opens a file, ")" closes the innermost one
+FILE_TOKEN_PATTERN = re.compile(r'\(([^\s()]+\.[A-Za-z0-9]+)|[()]')
+
+# Lines after "! ..." searched for the "l.<n>" marker
+ERROR_CONTEXT_LINES = 8
+KINDS = ("error", "undefined", "warning", "overfull")
+
+
+class LogEntry:
+    def __init__(self, kind, message, file=None, line=None, context=""):
+        self.kind = kind
+        self.message = message
+        self.file = file
+        # 1-based line in file, when the log names one
+        self.line = line
+        self.context = context
+
+
+class LogSummary:
+    def __init__(self, entries, counts):
+        self.entries = entries
+        self.counts = counts
+
+    @property
+    def truncated(self):
+        return sum(self.counts.values()) > len(self.entries)
+
+    def of_kind(self, kind):
+        return [entry for entry in self.entries if entry.kind == kind]
+
+
+def _clean_name(name):
+    return name[2:] if name.startswith("./") else name
+
+
+def iter_log_entries(lines):
+    # Yields LogEntry records while reading the log once; only the open-file stack, the pending
+    # warning and a few lines of error context are kept in memory
+    files = []
+    warning = None
+    error = None
+    error_lines = 0
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+
+        if error is not None:
+            match = ERROR_LINE_PATTERN.match(line)
+            if match:
+                error.line = error.line or int(match.group(1))
+                error.context = match.group(2).strip()
+                yield error
+                error = None
+                continue
+            error_lines -= 1
+            if ERROR_PATTERN.match(line) or FILE_LINE_ERROR_PATTERN.match(line):
+                # Next error before a line marker; read this line as a new record
+                yield error
+                error = None
+            else:
+                if error_lines == 0:
+                    yield error
+                    error = None
+                continue
+
+        if warning is not None:
+            match = CONTINUATION_PATTERN.match(line)
+            if match:
+                warning.message += " " + match.group(2).strip()
+                continue
+            yield _finish_warning(warning)
+            warning = None
+
+        current = next((name for name in reversed(files) if name), None)
+        match = FILE_LINE_ERROR_PATTERN.match(line)
+        if match:
+            error = LogEntry("error", match.group(3), _clean_name(match.group(1)), int(match.group(2)))
+            error_lines = ERROR_CONTEXT_LINES
+            continue
+        match = ERROR_PATTERN.match(line)
+        if match:
+            error = LogEntry("error", match.group(1), current)
+            error_lines = ERROR_CONTEXT_LINES
+            continue
+        match = WARNING_PATTERN.match(line)
+        if match:
+            warning = LogEntry("warning", f"{match.group(1)}: {match.group(2)}", current)
+            continue
+        match = OVERFULL_PATTERN.match(line)
+        if match:
+            yield LogEntry("overfull", line, current, int(match.group(2)) if match.group(2) else None)
+            continue
+
+        # Anything else may open or close input files
+        for token in FILE_TOKEN_PATTERN.finditer(line):
+            if token.group(1):
+                files.append(_clean_name(token.group(1)))
+            elif token.group(0) == "(":
+                files.append(None)
+            elif files:
+                files.pop()
+
+    if warning is not None:
+        yield _finish_warning(warning)
+    if error is not None:
+        yield error
+
+
+def _finish_warning(warning):
+    match = INPUT_LINE_PATTERN.search(warning.message)
+    if match:
+        warning.line = int(match.group(1))
+    if UNDEFINED_PATTERN.search(warning.message):
+        warning.kind = "undefined"
+    return warning
+
+
+def parse_log(lines, max_entries=200):
+    # Keeps the first max_entries records (errors first), but counts every one
+    counts = dict.fromkeys(KINDS, 0)
+    kept = {kind: [] for kind in KINDS}
+    for entry in iter_log_entries(lines):
+        counts[entry.kind] += 1
+        if counts[entry.kind] <= max_entries:
+            kept[entry.kind].append(entry)
+    entries = []
+    for kind in KINDS:
+        entries.extend(kept[kind][:max_entries - len(entries)])
+    return LogSummary(entries, counts)
+
+
+def parse_log_file(path, max_entries=200):
+    if not os.path.exists(path):
+        return LogSummary([], dict.fromkeys(KINDS, 0))
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return parse_log(f, max_entries)
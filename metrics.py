@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus text exposition of compile/render timings. With static serving on, Streamlit serves
+# this file at ./app/static/metrics.txt, which a Prometheus scrape job can point at.
+METRICS_FILE = os.environ.get(
+    "LATEX_METRICS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "metrics.txt")
+)
+
+# Upper bounds in seconds, from a cached page render up to a long bibliography build
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    "latex_compile_seconds": "Wall time of whole compile jobs",
+    "latex_compile_phase_seconds": "Time spent in each compile phase",
+    "latex_compiles_total": "Finished compile jobs by outcome",
+    "latex_pdflatex_passes_total": "pdflatex passes run",
+    "latex_pdf_load_seconds": "Time to take over and open a compiled PDF",
+    "latex_page_render_seconds": "Time to rasterize one PDF page",
+    "latex_page_cache_total": "Page requests served from or missing the render cache",
+    "latex_pdf_index_seconds": "Time to extract and index the text of a compiled PDF",
+    "latex_thumbnail_seconds": "Wall time of a thumbnail worker process, start-up included",
+}
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    # Thread-safe counters and histograms, written to a text file shortly after they change
+    def __init__(self, path=METRICS_FILE, buckets=DEFAULT_BUCKETS, write_interval=1.0):
+        self.path = path
+        self.buckets = buckets
+        self.write_interval = write_interval
+        self._counters = {}
+        # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._schedule_write()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            values = self._histograms.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += 1
+            values[-1] += seconds
+        self._schedule_write()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), values in histograms:
+            describe(name, "histogram")
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {values[-2]}")
+            lines.append(f"{name}_count{_label_text(labels)} {values[-2]}")
+            lines.append(f"{name}_sum{_label_text(labels)} {values[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        with self._lock:
+            self._timer = None
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def _schedule_write(self):
+        # Coalesce bursts of observations into one file write
+        with self._lock:
+            if self._timer is not None or not self.path:
+                return
+            self._timer = threading.Timer(self.write_interval, self.write)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+# Shared by the engine, the renderers and the apps in this process
+METRICS = MetricsRegistry()
@@ -0,0 +1,310 @@
+import bisect
+import os
+import re
+
+# Sectioning commands and the indentation level used in the TOC panels
+SECTION_LEVELS = {
+    "part": 0,
+    "chapter": 0,
+    "section": 0,
+    "subsection": 1,
+    "subsubsection": 2,
+    "paragraph": 3,
+    "subparagraph": 4
+}
+# Sectioning commands from the outermost in; each has a LaTeX counter of the same name
+SECTION_ORDER = ("part", "chapter", "section", "subsection", "subsubsection", "paragraph", "subparagraph")
+HEADING_PATTERN = re.compile(
+    r'\\(part|chapter|section|subsection|subsubsection|paragraph|subparagraph|input|include)\b(\*?)\s*'
+)
+# Longest heading (command, short title and braced title, in characters) followed across
+# line breaks while matching braces
+MAX_TITLE_LENGTH = 2000
+# \input/\include nesting followed when expanding the outline
+MAX_INCLUDE_DEPTH = 8
+
+
+def common_prefix_length(a, b):
+    # Galloping slice comparisons run in C, so this stays fast on large documents
+    limit = min(len(a), len(b))
+    i = 0
+    chunk = 256
+    while chunk:
+        if i + chunk <= limit and a[i:i + chunk] == b[i:i + chunk]:
+            i += chunk
+            chunk = min(chunk * 2, 1 << 20)
+        else:
+            chunk //= 2
+    return i
+
+
+def common_suffix_length(a, b, limit):
+    # limit keeps the suffix from overlapping the common prefix
+    i = 0
+    chunk = 256
+    while chunk:
+        if i + chunk <= limit and a[len(a) - i - chunk:len(a) - i] == b[len(b) - i - chunk:len(b) - i]:
+            i += chunk
+            chunk = min(chunk * 2, 1 << 20)
+        else:
+            chunk //= 2
+    return i
+
+
+def read_braced(text, pos, limit):
+    # Returns (content, end) for a {...} group starting at pos, honouring nested braces
+    limit = min(len(text), limit)
+    if pos >= limit or text[pos] != "{":
+        return None, pos
+    depth = 0
+    i = pos
+    while i < limit:
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[pos + 1:i], i + 1
+        i += 1
+    return None, pos
+
+
+def skip_optional(text, pos, limit):
+    # Skips a [short title] argument
+    if pos < len(text) and text[pos] == "[":
+        end = text.find("]", pos, limit)
+        if end >= 0:
+            pos = end + 1
+            while pos < len(text) and text[pos] in " \t":
+                pos += 1
+    return pos
+
+
+def is_commented(text, pos):
+    line_start = text.rfind("\n", 0, pos) + 1
+    i = text.find("%", line_start, pos)
+    while i >= 0:
+        backslashes = 0
+        j = i - 1
+        while j >= line_start and text[j] == "\\":
+            backslashes += 1
+            j -= 1
+        if backslashes % 2 == 0:
+            return True
+        i = text.find("%", i + 1, pos)
+    return False
+
+
+def find_uncommented(text, needle, start=0, end=None):
+    end = len(text) if end is None else end
+    pos = text.find(needle, start, end)
+    while pos >= 0 and is_commented(text, pos):
+        pos = text.find(needle, pos + 1, end)
+    return pos
+
+
+def section_source(text, span):
+    # The preamble plus one span from OutlineIndex.section_span, as a document of its own. Blank
+    # lines stand in for the rest of the body so the section keeps its line numbers, and log
+    # messages still point at the right lines of the full document.
+    setup = "\\appendix" if span["appendix"] else ""
+    if span["level"]:
+        # Number the section as it is numbered in the full document
+        setup += f"\\setcounter{{{span['level']}}}{{{span['number']}}}"
+    padding = "\n" * text.count("\n", span["body_start"], span["start"])
+    return (text[:span["body_start"]] + setup + padding + text[span["start"]:span["end"]]
+            + "\n\\end{document}\n")
+
+
+def scan_headings(text, start, end, first_line):
+    # Headings whose command starts in text[start:end]; line numbers count from first_line
+    entries = []
+    line = first_line
+    counted = start
+    for match in HEADING_PATTERN.finditer(text, start, end):
+        if is_commented(text, match.start()):
+            continue
+        command = match.group(1)
+        pos = match.end()
+        limit = match.start() + MAX_TITLE_LENGTH
+        if command in SECTION_LEVELS:
+            pos = skip_optional(text, pos, limit)
+        title, _ = read_braced(text, pos, limit)
+        if title is None:
+            continue
+        line += text.count("\n", counted, match.start())
+        counted = match.start()
+        if command in ("input", "include"):
+            entries.append({"kind": "input", "file": title.strip(), "line": line, "offset": match.start()})
+        else:
+            entries.append({
+                "kind": "heading",
+                "offset": match.start(),
+                "title": " ".join(title.split()),
+                "line": line,
+                "level": command,
+                "indent": SECTION_LEVELS[command],
+                "starred": bool(match.group(2))
+            })
+    return entries
+
+
+class OutlineIndex:
+    # Keeps the document outline up to date by re-scanning only the lines an edit touched
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir
+        self.text = ""
+        self.entries = []
+        # Parsed \input/\include files by path, invalidated by mtime
+        self._included = {}
+        # Last outline(); reused while edits leave the headings and line numbers alone
+        self._items = None
+        self._expanded_inputs = False
+
+    def update(self, text):
+        if text is self.text or text == self.text:
+            return self.outline()
+        prefix = common_prefix_length(self.text, text)
+        suffix = common_suffix_length(self.text, text, min(len(self.text), len(text)) - prefix)
+        return self._apply(text, prefix, len(self.text) - suffix, len(text) - suffix)
+
+    def apply_edit(self, start, end, replacement, text=None):
+        # self.text[start:end] was replaced by replacement; text is the edited document when the
+        # caller already has it, which saves copying a large document again
+        if text is None:
+            text = self.text[:start] + replacement + self.text[end:]
+        return self._apply(text, start, end, start + len(replacement))
+
+    def _line_at(self, text, offset):
+        # Count newlines from the closest known heading instead of from the top of the document
+        index = bisect.bisect_right(self.entries, offset, key=lambda e: e["offset"])
+        if index == 0:
+            return text.count("\n", 0, offset)
+        entry = self.entries[index - 1]
+        return entry["line"] + text.count("\n", entry["offset"], offset)
+
+    def _apply(self, new, start, end, new_end):
+        # old[start:end] became new[start:new_end]
+        old = self.text
+
+        # Widen to whole lines, reaching back far enough to re-read any heading whose braced
+        # title could run into the edited text
+        region_start = old.rfind("\n", 0, max(start - MAX_TITLE_LENGTH, 0)) + 1
+        old_region_end = old.find("\n", end)
+        old_region_end = len(old) if old_region_end < 0 else old_region_end
+        new_region_end = new.find("\n", new_end)
+        new_region_end = len(new) if new_region_end < 0 else new_region_end
+
+        first_line = self._line_at(old, region_start)
+        old_last_line = first_line + old.count("\n", region_start, old_region_end)
+        line_delta = new.count("\n", region_start, new_region_end) - (old_last_line - first_line)
+        offset_delta = new_region_end - old_region_end
+
+        offset = lambda e: e["offset"]
+        lo = bisect.bisect_left(self.entries, region_start, key=offset)
+        hi = bisect.bisect_right(self.entries, old_region_end, key=offset)
+        old_entries = self.entries[lo:hi]
+        scanned = scan_headings(new, region_start, new_region_end, first_line)
+        after = self.entries[hi:]
+        for entry in after:
+            entry["line"] += line_delta
+            entry["offset"] += offset_delta
+        self.entries = self.entries[:lo] + scanned + after
+        self.text = new
+        if line_delta or not self._same_headings(old_entries, scanned):
+            self._items = None
+        return self.outline()
+
+    def _same_headings(self, old, new):
+        # True when only offsets differ, i.e. the outline shown to the user is unchanged
+        if len(old) != len(new):
+            return False
+        for a, b in zip(old, new):
+            if any(a[k] != b[k] for k in a if k != "offset"):
+                return False
+        return True
+
+    def section_span(self, line):
+        # The top-level section (part, chapter or section, whichever the document uses) around a
+        # 0-based line, with the offsets of its text; before the first heading that is the front
+        # matter. None when the document has no \begin{document}.
+        text = self.text
+        begin = find_uncommented(text, "\\begin{document}")
+        if begin < 0:
+            return None
+        body_start = begin + len("\\begin{document}")
+        body_end = find_uncommented(text, "\\end{document}", body_start)
+        body_end = len(text) if body_end < 0 else body_end
+        headings = [entry for entry in self.entries
+                    if entry["kind"] == "heading" and body_start <= entry["offset"] < body_end]
+        span = {"body_start": body_start, "start": body_start, "end": body_end, "title": "Front matter",
+                "level": None, "number": 0, "appendix": False}
+        if not headings:
+            return span
+        top = min(SECTION_ORDER.index(entry["level"]) for entry in headings)
+        tops = [entry for entry in headings if SECTION_ORDER.index(entry["level"]) == top]
+        index = bisect.bisect_right(tops, line, key=lambda e: e["line"]) - 1
+        if index < 0:
+            span["end"] = tops[0]["offset"]
+            return span
+        entry = tops[index]
+        appendix = find_uncommented(text, "\\appendix", body_start, entry["offset"])
+        span.update(
+            start=entry["offset"],
+            end=tops[index + 1]["offset"] if index + 1 < len(tops) else body_end,
+            title=entry["title"],
+            level=entry["level"],
+            # The counter value just before this heading: starred headings are not numbered and
+            # \appendix starts counting again
+            number=sum(1 for e in tops[:index] if not e["starred"] and e["offset"] > appendix),
+            appendix=appendix >= 0
+        )
+        return span
+
+    def outline(self):
+        # Outlines with \input/\include entries are rebuilt every time since those files can change
+        if self._items is None or self._expanded_inputs:
+            items = []
+            self._expanded_inputs = False
+            self._expand(self.entries, None, None, items, 0)
+            self._items = items
+        return list(self._items)
+
+    def _expand(self, entries, file_name, jump_line, items, depth):
+        for entry in entries:
+            # Entries from included files jump to the \input line in the main document
+            line = entry["line"] if jump_line is None else jump_line
+            if entry["kind"] == "heading":
+                item = dict(entry, line=line)
+                del item["kind"], item["offset"]
+                if file_name is not None:
+                    item["file"] = file_name
+                    item["source_line"] = entry["line"]
+                items.append(item)
+            elif depth < MAX_INCLUDE_DEPTH:
+                self._expanded_inputs = True
+                included = self._included_entries(entry["file"])
+                if included:
+                    self._expand(included, entry["file"], line, items, depth + 1)
+
+    def _included_entries(self, name):
+        if self.base_dir is None:
+            return []
+        path = os.path.join(self.base_dir, name)
+        if not os.path.splitext(path)[1]:
+            path += ".tex"
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return []
+        cached = self._included.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                content = f.read()
+            cached = (mtime, scan_headings(content, 0, len(content), 0))
+            self._included[path] = cached
+        return cached[1]
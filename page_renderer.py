@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import METRICS
+from pdf_documents import FITZ_LOCK
+
+
+class PageRenderer:
+    # Rendered PNG pages keyed by (page content hash, zoom), with the neighbours prefetched. PDFs
+    # are opened through the PdfDocumentManager, so their handles count against its memory budget.
+    def __init__(self, documents, max_pages=64, workers=2):
+        self.documents = documents
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+
+    def _rasterize(self, key, pdf_hash, pdf_path, page_index):
+        import fitz  # PyMuPDF, loaded with the first page rendered
+        zoom = key[1]
+        with FITZ_LOCK:
+            started = time.perf_counter()
+            doc = self.documents.open_document(pdf_hash, pdf_path)
+            pix = doc.load_page(page_index).get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            png = pix.tobytes("png")
+            METRICS.observe("latex_page_render_seconds", time.perf_counter() - started, zoom=zoom)
+        with self._lock:
+            self._pages[key] = png
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return png
+
+    def _claim(self, key):
+        # Caller holds _lock. Registers key as in flight, so a render or prefetch of the same page
+        # waits on this future instead of rasterizing it a second time
+        future = Future()
+        self._pending[key] = future
+        return future
+
+    def _fill(self, future, key, pdf_hash, pdf_path, page_index):
+        # Rasterizes a claimed page into its future, then drops the claim (only this one: the key
+        # may have been claimed again since)
+        try:
+            future.set_result(self._rasterize(key, pdf_hash, pdf_path, page_index))
+        except Exception as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+
+    def _schedule(self, key, pdf_hash, pdf_path, page_index):
+        # Caller holds _lock
+        future = self._pending.get(key)
+        if future is None:
+            future = self._claim(key)
+            self._executor.submit(self._fill, future, key, pdf_hash, pdf_path, page_index)
+        return future
+
+    def _key(self, pdf_hash, page_index, zoom, page_hashes):
+        # Keyed by page content when the caller has per-page hashes, so a page a rebuild left
+        # unchanged is served from the cache; otherwise by PDF and page number
+        if page_hashes:
+            return page_hashes[page_index], zoom
+        return (pdf_hash, page_index), zoom
+
+    def page_count(self, pdf_hash, pdf_path):
+        with FITZ_LOCK:
+            return self.documents.open_document(pdf_hash, pdf_path).page_count
+
+    def render(self, pdf_hash, pdf_path, page_index, zoom=2, prefetch=True, page_hashes=None):
+        key = self._key(pdf_hash, page_index, zoom, page_hashes)
+        with self._lock:
+            png = self._pages.get(key)
+            if png is not None:
+                self._pages.move_to_end(key)
+            future = claimed = None
+            if png is None:
+                future = self._pending.get(key)
+                if future is None:
+                    future = claimed = self._claim(key)
+        METRICS.inc("latex_page_cache_total", result="hit" if png is not None else "miss")
+        if claimed is not None:
+            # Nothing in flight for this page: render it here, under a claim prefetches can see
+            self._fill(claimed, key, pdf_hash, pdf_path, page_index)
+        if png is None:
+            png = future.result()
+        if prefetch:
+            self.prefetch(pdf_hash, pdf_path, (page_index - 1, page_index + 1), zoom, page_hashes)
+        return png
+
+    def prefetch(self, pdf_hash, pdf_path, page_indexes, zoom=2, page_hashes=None):
+        total = len(page_hashes) if page_hashes else self.page_count(pdf_hash, pdf_path)
+        with self._lock:
+            for index in page_indexes:
+                if not 0 <= index < total:
+                    continue
+                key = self._key(pdf_hash, index, zoom, page_hashes)
+                if key not in self._pages:
+                    self._schedule(key, pdf_hash, pdf_path, index)
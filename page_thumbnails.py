@@ -0,0 +1,125 @@
+import argparse
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import METRICS
+
+# Small PNGs of pages, one folder per width, named by page content hash so pages a rebuild left
+# unchanged keep their thumbnail; files are never modified once written
+THUMBNAIL_ROOT = os.path.join(tempfile.gettempdir(), "latex_thumbnails")
+
+THUMBNAIL_WIDTH = 120
+# Longest a worker process may take over its share of the pages
+WORKER_TIMEOUT = 120
+
+
+def render_thumbnails(pdf_path, page_indexes, names, out_dir, width):
+    # Writes <out_dir>/<name>.png for each page, scaled to width pixels. Runs in the worker
+    # processes only, so the app itself never imports PyMuPDF for thumbnails.
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        for index, name in zip(page_indexes, names):
+            page = doc.load_page(index)
+            zoom = width / page.rect.width
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            target = os.path.join(out_dir, f"{name}.png")
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            pix.save(tmp_path, output="png")
+            os.replace(tmp_path, target)
+
+
+class PageThumbnails:
+    # Renders page thumbnails right after each build in a pool of worker processes, so neither the
+    # GIL nor the page renderer's MuPDF lock is held while they are made. Workers are started with
+    # subprocess rather than multiprocessing: Streamlit runs the app as __main__, and spawned
+    # multiprocessing children would run the whole app script again.
+    def __init__(self, root=THUMBNAIL_ROOT, width=THUMBNAIL_WIDTH, workers=None, max_files=4096):
+        self.root = root
+        self.width = width
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_files = max_files
+        # pdf hash -> futures of the worker processes still running for it
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnails")
+        self.directory = os.path.join(self.root, f"w{self.width}")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, page_hash):
+        return os.path.join(self.directory, f"{page_hash}.png")
+
+    def _run_worker(self, pdf_path, pages):
+        started = time.perf_counter()
+        command = [sys.executable, os.path.abspath(__file__), pdf_path, self.directory, "--width", str(self.width),
+                   "--pages", *(str(index) for index, _ in pages), "--names", *(name for _, name in pages)]
+        subprocess.run(command, check=True, timeout=WORKER_TIMEOUT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        METRICS.observe("latex_thumbnail_seconds", time.perf_counter() - started)
+
+    def submit(self, pdf_hash, pdf_path, page_hashes):
+        # Queue the pages with no thumbnail on disk, split evenly so each worker starts only once
+        missing = []
+        for index, page_hash in enumerate(page_hashes):
+            try:
+                # Marks the thumbnail as recently used for eviction
+                os.utime(self.path(page_hash))
+            except FileNotFoundError:
+                missing.append((index, page_hash))
+        with self._lock:
+            if not missing or self._pending.get(pdf_hash):
+                return
+            per_worker = math.ceil(len(missing) / self.workers)
+            futures = [self._executor.submit(self._run_worker, pdf_path, missing[start:start + per_worker])
+                       for start in range(0, len(missing), per_worker)]
+            self._pending[pdf_hash] = futures
+        for future in futures:
+            future.add_done_callback(lambda future, pdf_hash=pdf_hash: self._finished(pdf_hash))
+        self._evict()
+
+    def _finished(self, pdf_hash):
+        # A failed worker leaves its pages without thumbnails; the strip shows placeholders for them
+        with self._lock:
+            futures = self._pending.get(pdf_hash)
+            if futures and all(f.done() for f in futures):
+                del self._pending[pdf_hash]
+
+    def done(self, pdf_hash):
+        with self._lock:
+            return pdf_hash not in self._pending
+
+    def paths(self, page_hashes):
+        # Thumbnail file per page, None for pages not rendered (yet)
+        paths = []
+        for page_hash in page_hashes:
+            path = self.path(page_hash)
+            paths.append(path if os.path.exists(path) else None)
+        return paths
+
+    def _evict(self):
+        # Drop the least recently used thumbnails beyond max_files
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    # Worker entry point used by PageThumbnails
+    parser = argparse.ArgumentParser(description="Render PDF page thumbnails")
+    parser.add_argument("pdf_path")
+    parser.add_argument("out_dir")
+    parser.add_argument("--width", type=int, default=THUMBNAIL_WIDTH)
+    parser.add_argument("--pages", type=int, nargs="+", required=True, help="0-based page indexes")
+    parser.add_argument("--names", nargs="+", required=True, help="File name (without .png) for each page")
+    args = parser.parse_args()
+    render_thumbnails(args.pdf_path, args.pages, args.names, args.out_dir, args.width)
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import re
+
+# Citation commands (\cite, \citep, \citet, \nocite, ...) with optional [pre][post] notes
+CITE_PATTERN = re.compile(r'\\(?:no)?cite[a-zA-Z]*\*?\s*(?:\[[^\]]*\]\s*){0,2}\{([^}]*)\}')
+LABEL_PATTERN = re.compile(r'\\label\s*\{([^}]*)\}')
+BIBLIOGRAPHY_PATTERN = re.compile(r'\\bibliography\s*\{([^}]*)\}')
+BIBSTYLE_PATTERN = re.compile(r'\\bibliographystyle\s*\{([^}]*)\}')
+COMMENT_PATTERN = re.compile(r'(?<!\\)%.*')
+
+# Auxiliary files whose changes mean another pdflatex pass is needed
+AUX_EXTENSIONS = (".aux", ".toc", ".lof", ".lot", ".out")
+
+# pdflatex/package messages asking for another pass
+RERUN_PATTERN = re.compile(r'Rerun to get')
+
+
+class SourceSummary:
+    def __init__(self, cite_keys, labels, bib_names, bib_style):
+        self.cite_keys = cite_keys
+        self.labels = labels
+        self.bib_names = bib_names
+        self.bib_style = bib_style
+
+
+def summarize_source(tex_source):
+    content = COMMENT_PATTERN.sub("", tex_source)
+    cite_keys = set()
+    for match in CITE_PATTERN.finditer(content):
+        cite_keys.update(key.strip() for key in match.group(1).split(",") if key.strip())
+    labels = {match.group(1).strip() for match in LABEL_PATTERN.finditer(content)}
+    bib_names = []
+    for match in BIBLIOGRAPHY_PATTERN.finditer(content):
+        bib_names.extend(name.strip() for name in match.group(1).split(",") if name.strip())
+    style = BIBSTYLE_PATTERN.search(content)
+    return SourceSummary(frozenset(cite_keys), frozenset(labels), tuple(bib_names),
+                         style.group(1).strip() if style else None)
+
+
+def bib_paths(build_dir, bib_names):
+    paths = []
+    for name in bib_names:
+        path = os.path.join(build_dir, name if name.endswith(".bib") else name + ".bib")
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def aux_digest(build_dir, stem):
+    h = hashlib.sha256()
+    for ext in AUX_EXTENSIONS:
+        path = os.path.join(build_dir, stem + ext)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(ext.encode("ascii") + f.read())
+    return h.hexdigest()
+
+
+class BuildState:
+    # What the previous build of a document in a session depended on
+    def __init__(self):
+        self.summary = None
+        # AuxBibliography bibtex last ran for, and the digest of those .bib files
+        self.bibliography = None
+        self.bib_digest = None
+
+
+class PassScheduler:
+    def __init__(self, max_passes=5):
+        self.max_passes = max_passes
+
+    def needs_bibtex(self, state, bibliography, bib_digest, build_dir, stem):
+        # Decided after the first pass from what it wrote to the .aux files, so citations and
+        # \bibliography commands in \input/\include files count as much as the main file's
+        if bibliography is None or not bibliography.bib_names:
+            return False
+        if not os.path.exists(os.path.join(build_dir, stem + ".bbl")):
+            return True
+        previous = state.bibliography
+        if previous is None:
+            return True
+        return (bibliography.citations != previous.citations
+                or bibliography.bib_names != previous.bib_names
+                or bibliography.bib_style != previous.bib_style
+                or bib_digest != state.bib_digest)
+
+    def needs_rerun(self, aux_before, aux_after, pass_log):
+        # A pass is final once the aux files it wrote match what it read
+        return aux_before != aux_after or bool(RERUN_PATTERN.search(pass_log))
+
+    def planned_passes(self, state, summary, run_bibtex, draft=False):
+        # Best guess of the pdflatex passes ahead; the aux check can still add or save one
+        if draft:
+            return 1
+        passes = 1
+        if run_bibtex:
+            passes += 2
+        elif state.summary is None or summary.labels != state.summary.labels:
+            passes += 1
+        return min(passes, self.max_passes)
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from metrics import METRICS
+
+# Content-addressed copies of compiled PDFs; files here are never modified once written
+PDF_STORE = os.path.join(tempfile.gettempdir(), "latex_pdfs")
+
+# MuPDF is not thread-safe. Every fitz call in the app (opening and hashing PDFs here, page
+# rendering, text indexing, draft figures) holds this one lock; reentrant so helpers can nest.
+FITZ_LOCK = threading.RLock()
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def page_digests(document):
+    # One hash per page of what it draws: size and rotation, the content stream, and the fonts,
+    # images and form XObjects it names. Font subset tags are left out since they change whenever
+    # any page of the document uses a new glyph.
+    digests = []
+    for page in document:
+        h = hashlib.sha256(f"{tuple(page.rect)}\0{page.rotation}\0".encode("utf-8"))
+        h.update(page.read_contents())
+        for _, _, _, basefont, name, _ in sorted(page.get_fonts(), key=lambda font: font[4]):
+            h.update(f"\0{name}={basefont.split('+')[-1]}".encode("utf-8"))
+        objects = [(item[7], item[0]) for item in page.get_images(full=True)]
+        objects.extend((item[1], item[0]) for item in page.get_xobjects())
+        # xref numbers differ between builds, so objects are identified by name and stream content
+        for name, digest in sorted((name, hashlib.sha256(document.xref_stream_raw(xref) or b"").digest())
+                                   for name, xref in objects):
+            h.update(f"\0{name}=".encode("utf-8") + digest)
+        digests.append(h.hexdigest()[:32])
+    return digests
+
+
+def changed_pages(previous_digests, digests):
+    # Indexes of pages whose content appears nowhere in the previous build
+    previous = set(previous_digests)
+    return [index for index, digest in enumerate(digests) if digest not in previous]
+
+
+class ManagedPdf:
+    def __init__(self, pdf_hash, path, size, page_count, page_hashes=()):
+        self.pdf_hash = pdf_hash
+        self.path = path
+        self.size = size
+        self.page_count = page_count
+        # Per-page content hashes; renders, thumbnails and text are cached by these
+        self.page_hashes = page_hashes
+        # Pages that differ from the session's previous PDF, None for its first one
+        self.changed_pages = None
+        self.last_used = time.monotonic()
+        # Time adopt() took to hash, store and open this PDF
+        self.load_seconds = 0.0
+
+    def read_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class PdfDocumentManager:
+    # Owns the one PDF each session is viewing: an immutable on-disk copy that MuPDF reads on
+    # demand, the fitz handles opened on it (shared by every reader, closed when memory runs
+    # short), and cleanup of both
+    def __init__(self, store_dir=PDF_STORE, memory_budget=256 * 1024 * 1024, session_ttl=24 * 3600):
+        self.store_dir = store_dir
+        self.memory_budget = memory_budget
+        self.session_ttl = session_ttl
+        self._sessions = OrderedDict()
+        # pdf hash -> adopt() calls between storing the file and registering it with a session
+        self._adopting = {}
+        # pdf hash -> (open fitz document, file size), least recently used first; guarded by
+        # FITZ_LOCK rather than _lock, since readers ask for a handle while holding FITZ_LOCK
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def path(self, pdf_hash):
+        return os.path.join(self.store_dir, f"{pdf_hash}.pdf")
+
+    def adopt(self, session_id, pdf_path):
+        # Take over a freshly built PDF; the build directory can be overwritten afterwards
+        started = time.perf_counter()
+        pdf_hash = file_digest(pdf_path)
+        stored = self.path(pdf_hash)
+        with self._lock:
+            # Claimed before the file is checked, so a release in another session cannot delete
+            # the stored copy between here and the registration below
+            self._adopting[pdf_hash] = self._adopting.get(pdf_hash, 0) + 1
+            if not os.path.exists(stored):
+                fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".part")
+                os.close(fd)
+                shutil.copyfile(pdf_path, tmp_path)
+                os.replace(tmp_path, stored)
+        try:
+            import fitz  # PyMuPDF, not needed until the first PDF is adopted
+            # A handle of its own, closed once the pages are hashed; renders open the shared one
+            with FITZ_LOCK, fitz.open(stored) as document:
+                managed = ManagedPdf(pdf_hash, stored, os.path.getsize(stored), document.page_count,
+                                     page_digests(document))
+        except Exception:
+            with self._lock:
+                self._finish_adopting(pdf_hash)
+                self._remove_if_unused(pdf_hash)
+            raise
+        managed.load_seconds = time.perf_counter() - started
+        METRICS.observe("latex_pdf_load_seconds", managed.load_seconds)
+        with self._lock:
+            self._finish_adopting(pdf_hash)
+            previous = self._sessions.pop(session_id, None)
+            self._sessions[session_id] = managed
+            if previous is not None:
+                managed.changed_pages = changed_pages(previous.page_hashes, managed.page_hashes)
+                self._remove_if_unused(previous.pdf_hash)
+        self.cleanup_stale_sessions()
+        return managed
+
+    def get(self, session_id):
+        with self._lock:
+            managed = self._sessions.get(session_id)
+            if managed is None or not os.path.exists(managed.path):
+                return None
+            self._sessions.move_to_end(session_id)
+            managed.last_used = time.monotonic()
+            return managed
+
+    def open_document(self, pdf_hash, pdf_path):
+        # The shared fitz handle on a PDF, opened on first use. Hold FITZ_LOCK while using it: the
+        # budget only closes handles under that lock, so it cannot close one mid-render.
+        import fitz
+        with FITZ_LOCK:
+            entry = self._documents.get(pdf_hash)
+            if entry is None:
+                entry = (fitz.open(pdf_path), os.path.getsize(pdf_path))
+                self._documents[pdf_hash] = entry
+                self._enforce_budget(keep=pdf_hash)
+            else:
+                self._documents.move_to_end(pdf_hash)
+            return entry[0]
+
+    def release(self, session_id):
+        with self._lock:
+            managed = self._sessions.pop(session_id, None)
+            if managed is not None:
+                self._remove_if_unused(managed.pdf_hash)
+
+    def cleanup_stale_sessions(self):
+        cutoff = time.monotonic() - self.session_ttl
+        with self._lock:
+            stale = [sid for sid, managed in self._sessions.items() if managed.last_used < cutoff]
+        for session_id in stale:
+            self.release(session_id)
+
+    def _close(self, pdf_hash):
+        # Caller holds FITZ_LOCK
+        entry = self._documents.pop(pdf_hash, None)
+        if entry is not None:
+            entry[0].close()
+
+    def _finish_adopting(self, pdf_hash):
+        # Caller holds _lock
+        count = self._adopting.pop(pdf_hash) - 1
+        if count:
+            self._adopting[pdf_hash] = count
+
+    def _remove_if_unused(self, pdf_hash):
+        # Caller holds _lock
+        if pdf_hash in self._adopting or any(managed.pdf_hash == pdf_hash for managed in self._sessions.values()):
+            return
+        with FITZ_LOCK:
+            self._close(pdf_hash)
+        try:
+            os.remove(self.path(pdf_hash))
+        except OSError:
+            pass
+
+    def _enforce_budget(self, keep=None):
+        # Caller holds FITZ_LOCK. Close the least recently used handles until open documents fit
+        open_size = sum(size for _, size in self._documents.values())
+        if open_size <= self.memory_budget:
+            return
+        for pdf_hash, (_, size) in list(self._documents.items()):
+            if open_size <= self.memory_budget:
+                break
+            if pdf_hash == keep:
+                continue
+            self._close(pdf_hash)
+            open_size -= size
+        # Let MuPDF drop cached fonts and decoded images that belonged to the closed documents
+        import fitz
+        fitz.TOOLS.store_shrink(100)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import threading
+
+# Streamlit serves <app dir>/static/* at ./app/static/* once server.enableStaticServing is on
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+BUILDS_SUBDIR = "builds"
+
+
+class PdfPublisher:
+    # Publishes compiled PDFs as content-addressed static files so the browser fetches them
+    # over plain HTTP (with range requests) instead of through the websocket
+    def __init__(self, static_dir=STATIC_DIR, max_files=64):
+        self.builds_dir = os.path.join(static_dir, BUILDS_SUBDIR)
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(self.builds_dir, exist_ok=True)
+
+    def publish(self, pdf_hash, pdf_path):
+        name = f"{pdf_hash}.pdf"
+        path = os.path.join(self.builds_dir, name)
+        with self._lock:
+            if os.path.exists(path):
+                # Mark as recently used so eviction keeps it
+                os.utime(path)
+            else:
+                fd, tmp_path = tempfile.mkstemp(dir=self.builds_dir, suffix=".part")
+                os.close(fd)
+                shutil.copyfile(pdf_path, tmp_path)
+                os.replace(tmp_path, path)
+                self._evict()
+        return f"./app/static/{BUILDS_SUBDIR}/{name}"
+
+    def _evict(self):
+        files = [os.path.join(self.builds_dir, name) for name in os.listdir(self.builds_dir)
+                 if name.endswith(".pdf")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,149 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import METRICS
+from pdf_documents import FITZ_LOCK
+
+WORD_PATTERN = re.compile(r'\w+')
+# Characters of context shown on each side of a match
+SNIPPET_CHARS = 60
+
+
+def _words(text):
+    return WORD_PATTERN.findall(text.casefold())
+
+
+class PdfTextIndex:
+    # Inverted index of one PDF: word -> pages it appears on, plus each page's text for snippets
+    def __init__(self, page_texts):
+        self.page_texts = page_texts
+        postings = {}
+        for page, text in enumerate(page_texts):
+            for word in set(_words(text)):
+                postings.setdefault(word, array("i")).append(page)
+        self.postings = postings
+        # Sorted words, for prefix matches on the word still being typed
+        self.vocabulary = sorted(postings)
+
+    def _pages_with(self, word, prefix=False):
+        if not prefix:
+            return set(self.postings.get(word, ()))
+        pages = set()
+        index = bisect.bisect_left(self.vocabulary, word)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(word):
+            pages.update(self.postings[self.vocabulary[index]])
+            index += 1
+        return pages
+
+    def search(self, query, limit=20):
+        # [(1-based page, (before, match, after), phrase matches)], pages with the words as a phrase
+        # first. The last word matches as a prefix so results show up while it is being typed.
+        words = _words(query)
+        if not words:
+            return []
+        pages = self._pages_with(words[-1], prefix=True)
+        for word in words[:-1]:
+            if not pages:
+                break
+            pages &= self._pages_with(word)
+        phrase = re.compile(r'\b' + r'\W+'.join(map(re.escape, words)), re.IGNORECASE)
+        first_word = re.compile(r'\b' + re.escape(words[0]), re.IGNORECASE)
+        phrase_hits = []
+        word_hits = []
+        for page in sorted(pages):
+            text = self.page_texts[page]
+            matches = list(phrase.finditer(text))
+            if matches:
+                phrase_hits.append((page + 1, self._snippet(text, matches[0]), len(matches)))
+            else:
+                match = first_word.search(text)
+                snippet = self._snippet(text, match) if match else ("", "", text[:2 * SNIPPET_CHARS])
+                word_hits.append((page + 1, snippet, 0))
+        return (phrase_hits + word_hits)[:limit]
+
+    def _snippet(self, text, match):
+        # (text before, the match, text after), trimmed to SNIPPET_CHARS on each side
+        start = max(match.start() - SNIPPET_CHARS, 0)
+        end = min(match.end() + SNIPPET_CHARS, len(text))
+        return (("…" if start > 0 else "") + text[start:match.start()],
+                match.group(0),
+                text[match.end():end] + ("…" if end < len(text) else ""))
+
+
+def extract_page_texts(pdf_path, known=None):
+    # One whitespace-collapsed string per page; pages with a text in known (a list by page index,
+    # None where unknown) are not read again
+    import fitz  # PyMuPDF for text extraction
+    # Words split across lines by hyphenation are joined; ligatures are written out so "fi" finds "ﬁ"
+    flags = fitz.TEXT_DEHYPHENATE | fitz.TEXT_MEDIABOX_CLIP
+    texts = []
+    with fitz.open(pdf_path) as doc:
+        for index in range(doc.page_count):
+            if known and known[index] is not None:
+                texts.append(known[index])
+                continue
+            text = unicodedata.normalize("NFKC", doc.load_page(index).get_text("text", flags=flags))
+            texts.append(" ".join(text.split()))
+    return texts
+
+
+class PdfSearch:
+    # Text indexes of compiled PDFs keyed by PDF hash, built in the background as soon as a build
+    # finishes so searching never waits on text extraction. Page texts are also kept by page
+    # content hash, so a rebuild only extracts the pages that changed.
+    def __init__(self, max_documents=16, max_page_texts=20000, workers=1):
+        self.max_documents = max_documents
+        self.max_page_texts = max_page_texts
+        self._indexes = OrderedDict()
+        self._page_texts = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-index")
+
+    def _build(self, pdf_hash, pdf_path, page_hashes=None):
+        try:
+            with self._lock:
+                known = [self._page_texts.get(page_hash) for page_hash in page_hashes or ()]
+            with FITZ_LOCK:
+                started = time.perf_counter()
+                texts = extract_page_texts(pdf_path, known)
+                index = PdfTextIndex(texts)
+                METRICS.observe("latex_pdf_index_seconds", time.perf_counter() - started)
+            with self._lock:
+                for page_hash, text in zip(page_hashes or (), texts):
+                    self._page_texts[page_hash] = text
+                    self._page_texts.move_to_end(page_hash)
+                while len(self._page_texts) > self.max_page_texts:
+                    self._page_texts.popitem(last=False)
+                self._indexes[pdf_hash] = index
+                self._indexes.move_to_end(pdf_hash)
+                while len(self._indexes) > self.max_documents:
+                    self._indexes.popitem(last=False)
+        finally:
+            with self._lock:
+                self._pending.pop(pdf_hash, None)
+        return index
+
+    def submit(self, pdf_hash, pdf_path, page_hashes=None):
+        # Start indexing a newly adopted PDF unless it is indexed or queued already
+        with self._lock:
+            if pdf_hash in self._indexes or pdf_hash in self._pending:
+                return
+            self._pending[pdf_hash] = self._executor.submit(self._build, pdf_hash, pdf_path, page_hashes)
+
+    def index(self, pdf_hash, pdf_path, page_hashes=None):
+        with self._lock:
+            index = self._indexes.get(pdf_hash)
+            if index is not None:
+                self._indexes.move_to_end(pdf_hash)
+                return index
+            future = self._pending.get(pdf_hash)
+        return future.result() if future is not None else self._build(pdf_hash, pdf_path, page_hashes)
+
+    def search(self, pdf_hash, pdf_path, query, limit=20, page_hashes=None):
+        return self.index(pdf_hash, pdf_path, page_hashes).search(query, limit)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+# Shared folder of dumped preamble formats, one per distinct preamble
+FORMAT_ROOT = os.path.join(tempfile.gettempdir(), "latex_formats")
+
+# Project files whose contents end up inside the dumped format
+FORMAT_INPUT_EXTENSIONS = (".cls", ".sty", ".clo", ".def")
+
+
+def split_preamble(tex_source):
+    # Everything before \begin{document}; None when the document has no body marker
+    index = tex_source.find("\\begin{document}")
+    if index < 0:
+        return None
+    return tex_source[:index]
+
+
+class PreambleFormats:
+    def __init__(self, manuscript_dir, hasher, graph=None, format_root=FORMAT_ROOT, timeout=120):
+        self.manuscript_dir = manuscript_dir
+        self.hasher = hasher
+        # DependencyGraph narrowing the key to the class and packages the preamble loads
+        self.graph = graph
+        self.format_root = format_root
+        self.timeout = timeout
+        # Preamble keys whose dump failed; those documents compile without a format
+        self._failed = set()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.format_root, exist_ok=True)
+
+    def preamble_key(self, preamble):
+        h = hashlib.sha256(preamble.encode("utf-8"))
+        graph = self.graph.dependencies(preamble) if self.graph else None
+        if graph is not None and graph.complete:
+            inputs = [(name, path) for name, path in graph.files if name.endswith(FORMAT_INPUT_EXTENSIONS)]
+        else:
+            inputs = [(name, os.path.join(self.manuscript_dir, name)) for name in sorted(os.listdir(self.manuscript_dir))
+                      if name.endswith(FORMAT_INPUT_EXTENSIONS)]
+        for name, path in inputs:
+            h.update(f"\0{name}\0{self.hasher.digest(path)}".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def ensure(self, build_dir, tex_name, tex_source, run=None):
+        # Returns the format name to pass to pdflatex -fmt, dumping it first if the preamble is new.
+        # run(command) -> (returncode, output) lets the caller stream and cancel the dump.
+        preamble = split_preamble(tex_source)
+        if preamble is None:
+            return None
+        key = self.preamble_key(preamble)
+        fmt_name = f"preamble-{key}"
+        fmt_path = os.path.join(self.format_root, fmt_name + ".fmt")
+        with self._key_lock(key):
+            if os.path.exists(fmt_path):
+                return fmt_name
+            if key in self._failed:
+                return None
+            # mylatexformat dumps everything up to \begin{document} (or \endofdump)
+            built = os.path.join(build_dir, fmt_name + ".fmt")
+            command = ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={fmt_name}",
+                       "&pdflatex", "mylatexformat.ltx", tex_name]
+            try:
+                if run is not None:
+                    returncode, _ = run(command)
+                else:
+                    returncode = subprocess.run(command, cwd=build_dir, capture_output=True,
+                                                timeout=self.timeout).returncode
+                dumped = returncode == 0 and os.path.exists(built)
+            except OSError:
+                dumped = False
+            except subprocess.TimeoutExpired:
+                self._failed.add(key)
+                raise
+            if not dumped:
+                # Some preambles cannot be dumped (e.g. packages that open files at load time)
+                self._failed.add(key)
+                return None
+            shutil.move(built, fmt_path)
+            dump_log = os.path.join(build_dir, fmt_name + ".log")
+            if os.path.exists(dump_log):
+                os.remove(dump_log)
+        return fmt_name
+
+    def env(self, base_env=None):
+        # Let kpathsea find the shared formats ahead of the system ones
+        env = dict(base_env if base_env is not None else os.environ)
+        env["TEXFORMATS"] = self.format_root + os.pathsep + env.get("TEXFORMATS", "")
+        return env
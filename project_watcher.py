@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from compile_engine import BUILD_EXTENSIONS
+
+# Event types that mean a file's content may have changed ("closed" is a close after writing)
+CHANGE_EVENTS = ("created", "modified", "deleted", "moved", "closed")
+# Editor swap, backup and lock files, and vim's write probe
+IGNORED_SUFFIXES = ("~", ".swp", ".swx", ".tmp", ".part")
+IGNORED_NAMES = ("4913",)
+
+
+def _build_output(path, manuscript_dir):
+    # Whether path is what a local build of a top-level document writes next to it (main.pdf,
+    # main.aux beside main.tex). PDF figures and other files with these extensions are sources.
+    directory, name = os.path.split(path)
+    if directory != manuscript_dir:
+        return False
+    for ext in BUILD_EXTENSIONS:
+        if name.endswith(ext) and os.path.exists(os.path.join(directory, name[:-len(ext)] + ".tex")):
+            return True
+    return False
+
+
+def _ignored(path, manuscript_dir):
+    name = os.path.basename(path)
+    return (not name or name.startswith((".", "#")) or name in IGNORED_NAMES
+            or name.endswith(IGNORED_SUFFIXES) or _build_output(path, manuscript_dir))
+
+
+class ProjectWatcher(FileSystemEventHandler):
+    # Watches the project with inotify (through watchdog) and turns each burst of file changes into
+    # one numbered batch once writes pause for debounce seconds (or max_delay has passed), so an
+    # editor's save, or a script touching many figures, leads to one rebuild rather than several
+    def __init__(self, manuscript_dir, debounce=0.5, max_delay=5.0):
+        self.manuscript_dir = os.path.abspath(manuscript_dir)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # Number of the latest settled batch; sessions remember the one they last acted on
+        self.generation = 0
+        # path -> generation of the batch it last changed in
+        self._changed = {}
+        self._pending = set()
+        self._first_pending = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._observer = Observer()
+        self._observer.daemon = True
+        self._observer.schedule(self, self.manuscript_dir, recursive=True)
+        self._observer.start()
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in CHANGE_EVENTS:
+            return
+        paths = [os.fsdecode(path) for path in (event.src_path, getattr(event, "dest_path", "")) if path]
+        paths = [path for path in paths if not _ignored(path, self.manuscript_dir)]
+        if not paths:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pending.update(paths)
+            if self._first_pending is None:
+                self._first_pending = now
+            # Each event restarts the quiet period, but a constant stream of writes still settles
+            # after max_delay
+            delay = min(self.debounce, max(self._first_pending + self.max_delay - now, 0))
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._settle)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _settle(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self.generation += 1
+            for path in self._pending:
+                self._changed[path] = self.generation
+            self._pending.clear()
+            self._first_pending = None
+            self._timer = None
+
+    def changes_since(self, generation):
+        # (latest generation, paths changed after generation); a session that has not looked
+        # before (generation None) starts from now with no changes
+        with self._lock:
+            if generation is None:
+                return self.generation, set()
+            return self.generation, {path for path, changed in self._changed.items() if changed > generation}
+
+    def stop(self):
+        self._observer.stop()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
@@ -0,0 +1,107 @@
+import os
+import streamlit as st
+import streamlit.components.v1 as components
+
+# Ace editor that waits for a pause in typing and then sends only the changed span of text
+_component = components.declare_component(
+    "synced_editor",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synced_editor_frontend")
+)
+
+
+class EditorBuffer:
+    # Server-side copy of the editor text, kept in sync by applying the browser's edits in order
+    def __init__(self, text=""):
+        self.text = text
+        # Bumped whenever the server replaces the text, so the browser reloads it
+        self.version = 1
+        # Last edit sequence number applied
+        self.seq = 0
+        self.client_version = None
+        self.needs_full_text = False
+        # 0-based line of the browser's cursor when the editor last sent something, or None
+        self.cursor_line = None
+        # The text as last loaded from or saved to disk
+        self.saved_text = text
+
+    @property
+    def unsaved(self):
+        return self.text != self.saved_text
+
+    def mark_saved(self):
+        self.saved_text = self.text
+
+    def replace(self, text):
+        self.text = text
+        self.version += 1
+        self.seq = 0
+        self.needs_full_text = False
+
+    def apply(self, message):
+        # Returns the (start, end, replacement, text after the edit) edits applied, in order
+        if not message:
+            return []
+        if message.get("version") != self.version:
+            # The browser holds an older version or lost its copy (e.g. the frame was reloaded)
+            self.client_version = None
+            return []
+        self.client_version = self.version
+        self.cursor_line = message.get("cursor", self.cursor_line)
+        if "full" in message:
+            # Answer to a resync request: the browser's copy wins
+            if not self.needs_full_text:
+                return []
+            old = self.text
+            self.text = message["full"]
+            self.seq = message["seq"]
+            self.needs_full_text = False
+            return [(0, len(old), self.text, self.text)]
+        applied = []
+        for edit in sorted(message.get("edits", []), key=lambda e: e["seq"]):
+            if edit["seq"] <= self.seq:
+                continue
+            if edit["seq"] != self.seq + 1 or edit["end"] > len(self.text):
+                self.needs_full_text = True
+                break
+            self.text = self.text[:edit["start"]] + edit["text"] + self.text[edit["end"]:]
+            self.seq = edit["seq"]
+            applied.append((edit["start"], edit["end"], edit["text"], self.text))
+        if not self.needs_full_text and message.get("length") not in (None, len(self.text)):
+            # Offsets drifted somewhere; ask for the whole document once
+            self.needs_full_text = True
+        return applied
+
+
+def pull_edits(buffer, key):
+    # Applies the browser's latest edits; safe to call more than once per rerun
+    return buffer.apply(st.session_state.get(key))
+
+
+def synced_editor(buffer, key, height=500, theme="monokai", font_size=14, wrap=True,
+                  debounce_ms=750, goto_line=None, citations_url=None):
+    # Renders the editor for buffer and returns the edits that arrived since the last rerun.
+    # goto_line is 0-based; the cursor moves there once per call that passes it.
+    # citations_url points at a JSON list of [key, hint] offered inside \cite{...}; the browser
+    # downloads it once per URL.
+    goto_key = f"{key}_goto"
+    if goto_line is not None:
+        st.session_state[goto_key] = st.session_state.get(goto_key, 0) + 1
+    edits = pull_edits(buffer, key)
+    _component(
+        # The document is only sent when the browser does not have this version yet
+        text=None if buffer.client_version == buffer.version else buffer.text,
+        version=buffer.version,
+        ack=buffer.seq,
+        resync=buffer.needs_full_text,
+        height=height,
+        theme=theme,
+        font_size=font_size,
+        wrap=wrap,
+        debounce_ms=debounce_ms,
+        goto_line=goto_line,
+        goto_nonce=st.session_state.get(goto_key, 0),
+        citations_url=citations_url,
+        key=key,
+        default=None
+    )
+    return edits
@@ -0,0 +1,103 @@
+import bisect
+import gzip
+import os
+import re
+import zlib
+from array import array
+
+# Box and node records: <type><input tag>,<line>[,<column>]:<h>,<v>...
+RECORD_PATTERN = re.compile(rb'[\[(vhxkg$](\d+),(\d+)(?:,-?\d+)?:(-?\d+),(-?\d+)')
+INPUT_PATTERN = re.compile(rb'Input:(\d+):(.*)')
+RECORD_TYPES = b"[(vhxkg$"
+
+
+def synctex_path(pdf_path):
+    return os.path.splitext(pdf_path)[0] + ".synctex.gz"
+
+
+def _input_name(path):
+    # pdflatex writes "<build dir>/./main.tex"; keep the part relative to the build directory so
+    # PDFs restored from the cache into another session still match
+    if "/./" in path:
+        return path.split("/./", 1)[1]
+    return os.path.basename(path)
+
+
+class SynctexIndex:
+    # Source line <-> PDF page lookups for one build, read once from the .synctex.gz
+    def __init__(self, names, lines, pages, page_lines, page_count):
+        # input name -> tag
+        self.names = names
+        # tag -> sorted source lines (1-based) and the page each first appears on
+        self.lines = lines
+        self.pages = pages
+        # tag -> per page, the first source line typeset there (0 when none)
+        self.page_lines = page_lines
+        self.page_count = page_count
+
+    def page_for_line(self, name, line):
+        # Page showing the 1-based source line, or the next line that produced output
+        tag = self.names.get(name)
+        if tag is None or not self.lines[tag]:
+            return None
+        lines = self.lines[tag]
+        index = bisect.bisect_left(lines, line)
+        if index == len(lines):
+            index -= 1
+        return self.pages[tag][index]
+
+    def line_for_page(self, page, name):
+        # First 1-based source line typeset on page, or None if name put nothing there
+        tag = self.names.get(name)
+        if tag is None or not 1 <= page <= self.page_count:
+            return None
+        return self.page_lines[tag][page - 1] or None
+
+
+def parse_synctex(lines):
+    # lines: the decompressed file as bytes lines. Keeps only where each source line first shows
+    # up, which is all the lookups need.
+    names = {}
+    first = {}
+    page = 0
+    page_count = 0
+    for raw in lines:
+        start = raw[:1]
+        if start and start in RECORD_TYPES:
+            if page:
+                match = RECORD_PATTERN.match(raw)
+                if match:
+                    key = (int(match.group(1)), int(match.group(2)))
+                    if key not in first:
+                        first[key] = page
+        elif start == b"{":
+            page = int(raw[1:])
+            page_count = max(page_count, page)
+        elif start == b"}":
+            page = 0
+        elif raw.startswith(b"Input:"):
+            match = INPUT_PATTERN.match(raw.rstrip(b"\r\n"))
+            if match:
+                names[_input_name(os.fsdecode(match.group(2)))] = int(match.group(1))
+
+    lines = {tag: array("i") for tag in names.values()}
+    pages = {tag: array("i") for tag in names.values()}
+    page_lines = {tag: array("i", [0]) * page_count for tag in names.values()}
+    for (tag, line), first_page in sorted(first.items()):
+        if tag not in lines or line <= 0:
+            continue
+        lines[tag].append(line)
+        pages[tag].append(first_page)
+        top = page_lines[tag]
+        if not top[first_page - 1]:
+            top[first_page - 1] = line
+    return SynctexIndex(names, lines, pages, page_lines, page_count)
+
+
+def load_synctex(path):
+    # None when the build wrote no SyncTeX data or it is unreadable
+    try:
+        with gzip.open(path, "rb") as f:
+            return parse_synctex(f)
+    except (OSError, EOFError, ValueError, zlib.error):
+        return None